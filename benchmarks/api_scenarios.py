@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+""" Measures how the plugin operations scale against the in-process fake Google Tasks API.
+
+Every scenario runs on a fresh temporary notebook and reports wall time, HTTP round trips,
+API calls (batch items counted one by one) and peak Python memory.
+
+Run from the repository root in the environment Zim runs in, ex:
+    python benchmarks/api_scenarios.py --sizes 10 1000 20000 --latency 0.05
+"""
+import argparse
+import datetime
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from fake_tasks_api import FakeTasksApi  # noqa: E402
+from googletasks import CHECKED_BOX, TASK_ANCHOR_SYMBOL, GoogleCalendarApi, GoogletasksController, \
+    GoogletasksPlugin  # noqa: E402
+from zim.notebook import build_notebook, init_notebook  # noqa: E402
+from zim.newfs import LocalFolder  # noqa: E402
+
+SCENARIOS = {}
+
+
+def scenario(func):
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+class FakeCredentials:
+    invalid = False
+
+    @staticmethod
+    def authorize(http):
+        return http
+
+
+class Bench:
+    """ Fresh notebook and fake server for a scenario run. """
+
+    def __init__(self, folder, api: FakeTasksApi, rate=100):
+        self.api = api
+        self.tasklist = api.add_list("Benchmark")
+        self.other_tasklist = api.add_list("Other")
+        GoogleCalendarApi.http_factory = api.http
+        GoogleCalendarApi.get_credentials = lambda *_: FakeCredentials()
+        GoogleCalendarApi.discovery_file = str(Path(folder, "discovery.json"))
+        GoogleCalendarApi.invalidate()
+        init_notebook(LocalFolder(folder), name="Benchmark")
+        self.notebook, _ = build_notebook(LocalFolder(folder))
+        preferences = {p[0]: p[3] for p in GoogletasksPlugin.plugin_notebook_properties}
+        preferences["requests_per_second"] = rate
+        self.controller = GoogletasksController(notebook=self.notebook, preferences=preferences)
+
+    def add_tasks(self, size, days_ago=0, completed_every=0, tasklist=None):
+        due = datetime.date.today() - datetime.timedelta(days=days_ago)
+        return [self.api.add_task(tasklist or self.tasklist, f"Task {i}", due=due,
+                                  status="completed" if completed_every and not i % completed_every else "needsAction")
+                for i in range(size)]
+
+    def write_page(self, tasks):
+        page = self.notebook.get_home_page()
+        page.parse("wiki", "".join(f"[ ] [[gtasks://{task['id']}|{TASK_ANCHOR_SYMBOL}]] {task['title']}\n"
+                                   for task in tasks))
+        self.notebook.store_page(page)
+
+
+# Every scenario prepares the data and returns the operation to be measured.
+
+@scenario
+def fetch(bench: Bench, size):
+    bench.add_tasks(size)
+    return lambda: bench.controller.fetch(force=True)
+
+
+@scenario
+def fetch_lists(bench: Bench, size, lists=4):
+    """ The tasks are spread over several task lists, each imported to its own page. """
+    pages = []
+    for i in range(lists):
+        title = f"List {i}"
+        tasklist = bench.api.add_list(title)
+        bench.add_tasks(size // lists, tasklist=tasklist)
+        pages.append(f"{title}=Lists:{i}")
+    bench.controller.preferences["tasklist_pages"] = "; ".join(pages)
+    return lambda: bench.controller.fetch(force=True)
+
+
+@scenario
+def fetch_again(bench: Bench, size):
+    """ Nothing new on the server since the last import. """
+    bench.add_tasks(size)
+    bench.controller.fetch(force=True)
+    return lambda: bench.controller.fetch(force=True)
+
+
+@scenario
+def import_history(bench: Bench, size):
+    bench.add_tasks(size, days_ago=30)
+    return lambda: bench.controller.fetch(all_history=True)
+
+
+@scenario
+def sync(bench: Bench, size, anchors=5000):
+    """ Page with up to `anchors` tasks, some of them from another task list are looked up one by one. """
+    tasks = bench.add_tasks(size, days_ago=30, completed_every=2)
+    tasks = tasks[:anchors] + bench.add_tasks(min(size, anchors) // 20, tasklist=bench.other_tasklist)
+    bench.write_page(tasks)
+    return bench.controller.sync_bullets_from_server
+
+
+@scenario
+def submit_task(bench: Bench, size, count=100):
+    def run():
+        for i in range(min(size, count)):
+            bench.controller.submit_task({"title": f"Submitted {i}"})
+
+    return run
+
+
+@scenario
+def task_checked(bench: Bench, size, count=100):
+    tasks = bench.add_tasks(size)
+
+    def run():
+        for task in tasks[:count]:
+            bench.controller.task_checked(task["id"], CHECKED_BOX)
+
+    return run
+
+
+def measure(name, size, args, trace_memory):
+    with tempfile.TemporaryDirectory() as folder:
+        api = FakeTasksApi(latency=args.latency, page_size=args.page_size, error_rate=args.error_rate)
+        bench = Bench(folder, api, rate=args.rate)
+        operation = SCENARIOS[name](bench, size)
+        api.reset_counters()
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        operation()
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        tracemalloc.stop()
+        return wall, api.round_trips, sum(api.calls.values()), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 20000], help="number of server tasks")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per HTTP round trip")
+    parser.add_argument("--page-size", type=int, default=100, help="most tasks the server returns per page")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of 503 answers (retried)")
+    parser.add_argument("--rate", type=int, default=100, help="requests per second budget of the plugin")
+    args = parser.parse_args()
+
+    print(f"{'scenario':<16}{'tasks':>8}{'wall s':>10}{'round trips':>13}{'API calls':>11}{'peak MB':>9}")
+    for name in args.scenarios:
+        for size in args.sizes:
+            # memory tracing slows Python down, the time is measured in a separate run
+            wall, round_trips, calls, _ = measure(name, size, args, trace_memory=False)
+            peak = measure(name, size, args, trace_memory=True)[3]
+            print(f"{name:<16}{size:>8}{wall:>10.3f}{round_trips:>13}{calls:>11}{peak / 2 ** 20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
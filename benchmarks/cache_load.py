@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+""" Compares loading of the cache file in the former jsonpickle format and in the current format.
+
+Run from the repository root in the environment Zim runs in:
+    python benchmarks/cache_load.py [number of entries ...]
+"""
+import json
+import sys
+import tempfile
+from pathlib import Path
+from timeit import timeit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from googletasks import Cache  # noqa: E402
+
+REPEAT = 20
+
+
+def legacy_data(entries):
+    return {"items_ids": {"py/set": [f'"etag-{i:08}"' for i in range(entries)]},
+            "lists": {f"list {i}": f"id-{i}" for i in range(20)},
+            "last_fetched": 1600000000.0}
+
+
+def main(sizes):
+    try:
+        import jsonpickle
+    except ImportError:
+        jsonpickle = None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for entries in sizes:
+            legacy = Path(tmp, "legacy.cache")
+            legacy.write_text(json.dumps(legacy_data(entries)))
+            current = Path(tmp, "current.cache")
+            cache = Cache(legacy).load()
+            cache._path = current
+            cache.save()
+
+            results = {}
+            if jsonpickle:
+                results["jsonpickle"] = timeit(lambda: jsonpickle.decode(legacy.read_text()), number=REPEAT)
+            results["migration"] = timeit(lambda: Cache(legacy).load(), number=REPEAT)
+            results["current"] = timeit(lambda: Cache(current).load(), number=REPEAT)
+            print(f"{entries:>7} entries: " + ", ".join(f"{name} {seconds / REPEAT * 1000:.2f} ms"
+                                                       for name, seconds in results.items()))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,223 @@
+""" In-process stand-in for the Google Tasks v1 REST API.
+
+`FakeTasksApi.http()` returns an object with the `httplib2.Http.request` interface,
+to be set as `GoogleCalendarApi.http_factory`. Batch requests are understood too.
+"""
+import datetime
+import json
+import random
+import time
+from collections import Counter
+from email.parser import Parser as EmailParser
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httplib2
+
+BOUNDARY = "fake_tasks_api_boundary"
+
+
+def rfc3339(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.") + f"{dt.microsecond // 1000:03}Z"
+
+
+def parse_rfc3339(s):
+    return datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
+
+
+class FakeTasksApi:
+    """
+    :param latency: seconds every HTTP round trip takes
+    :param page_size: the most tasks a list() response contains, regardless of `maxResults`
+    :param error_rate: probability a call is answered by 503
+    """
+
+    def __init__(self, latency=0.0, page_size=100, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.lists = {}
+        "{tasklist ID: {task ID: task}}"
+        self.titles = {}
+        "{tasklist ID: title}"
+        self.round_trips = 0
+        self.calls = Counter()
+        "{API method: number of calls}, batch items counted one by one"
+        self._counter = 0
+
+    def add_list(self, title):
+        tasklist = f"list{len(self.lists)}"
+        self.lists[tasklist] = {}
+        self.titles[tasklist] = title
+        return tasklist
+
+    def add_task(self, tasklist, title, due=None, status="needsAction", notes=None):
+        self._counter += 1
+        now = datetime.datetime.now(datetime.timezone.utc)
+        task = {"kind": "tasks#task", "id": f"task{self._counter:08}", "etag": f'"etag{self._counter}"',
+                "title": title, "updated": rfc3339(now), "status": status, "position": f"{self._counter:020}"}
+        if due:
+            task["due"] = rfc3339(datetime.datetime.combine(due, datetime.time(), datetime.timezone.utc))
+        if notes:
+            task["notes"] = notes
+        if status == "completed":
+            task["completed"] = task["updated"]
+        self.lists[tasklist][task["id"]] = task
+        return task
+
+    def reset_counters(self):
+        self.round_trips = 0
+        self.calls.clear()
+
+    def http(self):
+        return FakeHttp(self)
+
+    # handling of the requests
+
+    def _resolve(self, tasklist):
+        if tasklist == "@default":
+            return next(iter(self.lists))
+        if tasklist not in self.lists:
+            raise KeyError(tasklist)
+        return tasklist
+
+    def handle(self, method, uri, body, headers=None):
+        """ :return: (status, response dict or None) """
+        url = urlsplit(uri)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        try:
+            parts = parts[parts.index("v1") + 1:]
+        except ValueError:
+            return 404, {"error": {"code": 404, "message": "Not found"}}
+        if self.error_rate and self._random.random() < self.error_rate:
+            return 503, {"error": {"code": 503, "message": "Backend Error"}}
+        body = json.loads(body) if body else {}
+        try:
+            if parts == ["users", "@me", "lists"]:
+                self.calls["tasklists.list"] += 1
+                return 200, self._page([{"kind": "tasks#taskList", "id": k, "title": t}
+                                        for k, t in self.titles.items()], params)
+            if len(parts) == 4 and parts[:3] == ["users", "@me", "lists"] and method == "GET":
+                self.calls["tasklists.get"] += 1
+                tasklist = self._resolve(parts[3])
+                return 200, {"kind": "tasks#taskList", "id": tasklist, "title": self.titles[tasklist]}
+            if len(parts) == 3 and parts[0] == "lists" and parts[2] == "tasks":
+                tasks = self.lists[self._resolve(parts[1])]
+                if method == "GET":
+                    self.calls["tasks.list"] += 1
+                    return 200, self._page(self._filter(tasks.values(), params), params)
+                if method == "POST":
+                    self.calls["tasks.insert"] += 1
+                    task = self.add_task(self._resolve(parts[1]), body.get("title", ""))
+                    task.update(body)
+                    return 200, task
+            if len(parts) == 4 and parts[0] == "lists" and parts[2] == "tasks":
+                task = self.lists[self._resolve(parts[1])][parts[3]]
+                if method == "GET":
+                    self.calls["tasks.get"] += 1
+                    return 200, task
+                if method in ("PATCH", "PUT"):
+                    self.calls["tasks.patch" if method == "PATCH" else "tasks.update"] += 1
+                    if (headers or {}).get("if-match", task["etag"]) != task["etag"]:
+                        return 412, {"error": {"code": 412, "message": "Precondition Failed"}}
+                    for key, value in body.items():
+                        if value is None:
+                            task.pop(key, None)
+                        else:
+                            task[key] = value
+                    self._counter += 1
+                    task["etag"] = f'"etag{self._counter}"'
+                    task["updated"] = rfc3339(datetime.datetime.now(datetime.timezone.utc))
+                    return 200, task
+        except KeyError:
+            self.calls["not found"] += 1
+            return 404, {"error": {"code": 404, "message": "Not found"}}
+        return 400, {"error": {"code": 400, "message": f"Unsupported {method} {url.path}"}}
+
+    def _filter(self, tasks, params):
+        def flag(name, default):
+            return params.get(name, str(default)).lower() == "true"
+
+        show_completed, show_hidden, show_deleted = \
+            flag("showCompleted", True), flag("showHidden", False), flag("showDeleted", False)
+        due_min = parse_rfc3339(params["dueMin"]) if "dueMin" in params else None
+        due_max = parse_rfc3339(params["dueMax"]) if "dueMax" in params else None
+        updated_min = parse_rfc3339(params["updatedMin"]) if "updatedMin" in params else None
+        result = []
+        for task in tasks:
+            if task.get("deleted") and not show_deleted \
+                    or task["status"] == "completed" and not (show_completed and show_hidden) \
+                    or updated_min and parse_rfc3339(task["updated"]) < updated_min:
+                continue
+            if due_min or due_max:
+                if "due" not in task:
+                    continue
+                due = parse_rfc3339(task["due"])
+                if due_min and due < due_min or due_max and due >= due_max:
+                    continue
+            result.append(task)
+        return result
+
+    def _page(self, items, params):
+        size = min(int(params.get("maxResults", 20)), self.page_size)
+        start = int(params.get("pageToken", 0))
+        response = {"items": items[start:start + size]}
+        if start + size < len(items):
+            response["nextPageToken"] = str(start + size)
+        return response
+
+    def handle_batch(self, content_type, body):
+        """ Answers a multipart/mixed batch request the way googleapiclient expects. """
+        message = EmailParser().parsestr(f"Content-Type: {content_type}\r\n\r\n{body}")
+        parts = []
+        for part in message.get_payload():
+            request_line, rest = part.get_payload().split("\n", 1)
+            method, path, _ = request_line.strip().split(" ", 2)
+            rest = rest.replace("\r\n", "\n")
+            header_lines, _, request_body = rest.partition("\n\n")
+            headers = {k.strip().lower(): v.strip() for k, _, v in
+                       (header.partition(":") for header in header_lines.splitlines()) if v}
+            status, response = self.handle(method, path, request_body.strip(), headers)
+            parts.append(f"--{BOUNDARY}\r\nContent-Type: application/http\r\n"
+                         f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                         f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                         f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                         f"{json.dumps(response)}\r\n")
+        return "".join(parts) + f"--{BOUNDARY}--\r\n"
+
+
+class FakeHttp:
+    """ Quacks like `httplib2.Http`. """
+
+    def __init__(self, api: FakeTasksApi):
+        self.api = api
+        self.timeout = None
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        api = self.api
+        api.round_trips += 1
+        if api.latency:
+            time.sleep(api.latency)
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        if "/discovery/" in uri or "$discovery" in uri:
+            return self._discovery()
+        if headers.get("content-type", "").startswith("multipart/mixed"):
+            content = api.handle_batch(headers["content-type"], body).encode("utf-8")
+            return httplib2.Response({"status": "200",
+                                      "content-type": f"multipart/mixed; boundary={BOUNDARY}"}), content
+        status, response = api.handle(method, uri, body, headers)
+        return httplib2.Response({"status": str(status), "content-type": "application/json; charset=UTF-8"}), \
+            json.dumps(response).encode("utf-8")
+
+    @staticmethod
+    def _discovery():
+        import googleapiclient
+        document = Path(googleapiclient.__file__).parent / "discovery_cache" / "documents" / "tasks.v1.json"
+        return httplib2.Response({"status": "200", "content-type": "application/json"}), document.read_bytes()
+
+    def close(self):
+        pass
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+""" Measures what the plugin costs at Zim startup, in fresh interpreters.
+
+* import: `import googletasks` and which Google API libraries it has loaded
+* eager imports: the Google API libraries the plugin used to import at module level
+* startup fetch: building the controller and the startup check when the tasks have been imported recently,
+  the work done before the window is shown
+
+Run from the repository root in the environment Zim runs in:
+    python benchmarks/startup.py [repetitions]
+"""
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY = ("googleapiclient.discovery", "oauth2client.client", "httplib2", "dateutil.parser")
+
+SNIPPETS = {
+    "import": """
+from time import perf_counter
+start = perf_counter()
+import googletasks
+print(perf_counter() - start, *[m for m in HEAVY if m in sys.modules])
+""",
+    "eager imports": """
+from time import perf_counter
+start = perf_counter()
+import googleapiclient.discovery, googleapiclient.errors, oauth2client.client, oauth2client.tools, oauth2client.file
+import httplib2, dateutil.parser, dateutil.relativedelta
+print(perf_counter() - start)
+""",
+    "startup fetch": """
+import tempfile
+from time import perf_counter
+import googletasks
+from zim.newfs import LocalFolder
+from zim.notebook import build_notebook, init_notebook
+with tempfile.TemporaryDirectory() as folder:
+    init_notebook(LocalFolder(folder), name="Benchmark")
+    notebook, _ = build_notebook(LocalFolder(folder))
+    preferences = {p[0]: p[3] for p in googletasks.GoogletasksPlugin.plugin_notebook_properties}
+    googletasks.GoogletasksController(notebook=notebook, preferences=preferences).cache.touch_save()
+    start = perf_counter()
+    googletasks.GoogletasksController(notebook=notebook, preferences=preferences).fetch()
+    print(perf_counter() - start, *[m for m in HEAVY if m in sys.modules])
+""",
+}
+
+
+def run(snippet):
+    code = f"import sys\nsys.path.insert(0, {str(ROOT)!r})\nHEAVY = {HEAVY!r}\n" + snippet
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), out[1:]
+
+
+def main(repetitions):
+    for name, snippet in SNIPPETS.items():
+        results = [run(snippet) for _ in range(repetitions)]
+        loaded = ", ".join(results[0][1]) or "none"
+        print(f"{name:<15}{statistics.median(r[0] for r in results) * 1000:>9.1f} ms"
+              f"{'' if name == 'eager imports' else '   Google API libraries loaded: ' + loaded}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -3,26 +3,35 @@
 #
 from __future__ import print_function
 
+import cProfile
 import datetime
+import functools
+import hashlib
+import importlib
+import json
 import logging
 import os
+import random
 import re
+import socket
+import socketserver
+import sqlite3
 import sys
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, suppress
+from difflib import SequenceMatcher
+from email.utils import parsedate_to_datetime
+from itertools import count, islice, takewhile
 from pathlib import Path
-from time import time
+from time import perf_counter, sleep, time
 from typing import TYPE_CHECKING
 
-import dateutil.parser
-import httplib2
-import jsonpickle
-from dateutil.relativedelta import relativedelta
-from gi.repository import Gtk
-from googleapiclient import discovery
-from googleapiclient.errors import Error
-from oauth2client import client, tools
-from oauth2client.file import Storage
+from gi.repository import GLib, Gtk
 from zim.actions import action, get_gtk_actiongroup, ActionClassMethod
-from zim.config import XDG_DATA_HOME, ConfigManager
+from zim.config import XDG_CACHE_HOME, XDG_DATA_HOME, ConfigManager
 from zim.formats import get_dumper
 from zim.formats.wiki import Parser
 
@@ -44,23 +53,113 @@ except RuntimeError:
         pass
 from zim.formats import CHECKED_BOX, UNCHECKED_BOX
 from zim.main import NotebookCommand
-from zim.main.command import GtkCommand
-from zim.notebook import build_notebook, Path as ZimPath
+from zim.main.command import GtkCommand, UsageError
+from zim.notebook import build_notebook, get_notebook_list, resolve_notebook, Path as ZimPath
 from zim.plugins import PluginClass
 from zim.gui.mainwindow import MainWindowExtension
 
 if TYPE_CHECKING:
     _ = str
 
+
+class LazyModule:
+    """ Module imported at the first attribute access.
+    Google API libraries take seconds to import, they are not needed until the first request. """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        self.__dict__.update(vars(module))  # next time, no __getattr__ is involved
+        return getattr(module, attr)
+
+
+httplib2 = LazyModule("httplib2")
+discovery = LazyModule("googleapiclient.discovery")
+errors = LazyModule("googleapiclient.errors")
+client = LazyModule("oauth2client.client")
+tools = LazyModule("oauth2client.tools")
+oauth2client_file = LazyModule("oauth2client.file")
+dateutil_parser = LazyModule("dateutil.parser")
+dateutil_relativedelta = LazyModule("dateutil.relativedelta")
+
 logger = logging.getLogger('zim.plugins.googletasks')
 CACHE_FILE = "googletasks.cache"
+OUTBOX_FILE = "googletasks.outbox"
+STORE_FILE = "googletasks.sqlite"
+STATS_FILE = "googletasks.stats.jsonl"
+OPEN_FILE = "googletasks.open"
+"Zim windows that have the notebook open mark it by OPEN_FILE.pid.window files, the daemon leaves their pages be."
+STATS_KEEP = 1000
+"Number of operations kept in the stats file."
 WORKDIR = str(XDG_DATA_HOME.folder(('zim', 'plugins')))
 CLIENT_SECRET_FILE = os.path.join(WORKDIR, 'googletasks_client_id.json')
+HTTP_CACHE_DIR = str(XDG_CACHE_HOME.folder(('zim', 'plugins', 'googletasks_http')))
+HTTP_CACHE_SIZE = 20 * 2 ** 20
+"Bytes, the least recently used responses are evicted above."
+LEDGER_TTL = 60 * 24 * 3600
+"Seconds an imported task is remembered before the last fetch."
+LEDGER_SIZE = 20000
+"Most imported tasks remembered, the least recently imported are forgotten above."
+PROFILES_DIR = str(XDG_CACHE_HOME.folder(('zim', 'plugins', 'googletasks_profiles')))
+PROFILES_KEEP = 50
+"Number of the newest profiles kept."
+PROFILE_ENV = "ZIM_GOOGLETASKS_PROFILE"
+"Environment variable that turns the profiling on, ex: ZIM_GOOGLETASKS_PROFILE=1 zim"
+DAEMON_SOCKET = os.path.join(str(XDG_CACHE_HOME.folder(('zim', 'plugins'))), 'googletasks.sock')
+POLL_MIN = 60
+POLL_MAX = 30 * 60
+"Seconds between the daemon polls. The interval doubles from POLL_MIN while nothing changes."
+POKE_DELAY = 5
+"Seconds the daemon waits after a local change before polling, so that more changes are caught at once."
 APPLICATION_NAME = 'googletasks2zim'
 TASK_ANCHOR_SYMBOL = u"\u270b"
 taskAnchorTreeRe = re.compile(r'(\[.\]\s)?\[\[gtasks://([^|]*)\|' + TASK_ANCHOR_SYMBOL + r'\]\]\s?(.*)')
 start_date_in_title = re.compile(r'(.*)>(\d{4}-\d{2}(-\d{2})?)(.*)')  # (_\{//)?  (//})?
+checkboxRe = re.compile(r'(\s*)\[(.)\]\s+(.*)')
 INVALID_DAY = "N/A"
+PAGE_SIZE = 100
+"Largest `maxResults` the Tasks API accepts for tasks().list() and tasklists().list()."
+BATCH_SIZE = 1000
+"Maximum number of calls in a single batch request."
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 5
+BACKOFF = 1
+"Seconds to wait before the first retry, doubled with every next one."
+MAX_BACKOFF = 64
+REQUEST_TIMEOUT = 30
+"Seconds to wait for the server, a stalled connection must not hang Zim."
+FETCH_WORKERS = 4
+"Maximum number of task lists fetched at once."
+
+
+timeRe = re.compile(r'(\d{4})-(\d\d)(?:-(\d\d)(?:T(\d\d):(\d\d):(\d\d)(?:\.(\d+))?(Z)?)?)?')
+TIME_MODES = {
+    "object": lambda dt: dt,
+    "date-only": lambda dt: dt.isoformat()[:10],
+    "midnight": lambda dt: dt.isoformat()[:11] + "00:00:00.000Z",
+    "morning": lambda dt: dt.isoformat()[:11] + "08:00:00.000Z",
+    "last-sec": lambda dt: dt.isoformat()[:11] + "23:59:59.999Z",
+    "day": lambda dt: dt.strftime("%A").lower()[:2]
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_time(s):
+    """ Parses the RFC 3339 timestamps the API returns (ex: '2018-12-14T00:00:00.000Z') and dates ('2021-05-03')
+    without dateutil. Free-form user input is left to dateutil.
+    Missing info is taken from the default 2020-01-01, so ex: '2021-05' will be converted to '2021-05-01'.
+    :raise ValueError: not a date
+    """
+    m = timeRe.fullmatch(s.strip())
+    if not m:
+        return dateutil_parser.parse(s, default=datetime.datetime(2020, 1, 1))
+    year, month, day, hour, minute, second, fraction, utc = m.groups()
+    return datetime.datetime(int(year), int(month), int(day or 1),
+                             int(hour or 0), int(minute or 0), int(second or 0),
+                             int((fraction or "0")[:6].ljust(6, "0")),
+                             datetime.timezone.utc if utc else None)
 
 
 class GoogletasksPlugin(PluginClass):
@@ -92,7 +191,13 @@ See `File / Properties / Google Tasks` for options, `Tools / Google Tasks` for a
                                          ' the task to appear not sooner than in January.'), False),
         ('page', 'page', _('Page to be updated (empty = homepage)'), ""),
         ('tasklist', 'string', _('Task list name on server (empty = default)'), ""),
+        ('tasklist_pages', 'string', _('Other task lists to be imported to their own pages'
+                                       '\nex: "Work=Projects:Work; Shopping=Home:Shopping"'), ""),
         ('postponing_days', 'int', _('Submitting a task: how many day buttons'), 9, (0, 40)),
+        ('requests_per_second', 'int', _('Most API requests per second'
+                                         '\nThe quota is per user, every notebook counts.'), 10, (1, 100)),
+        ('profile', 'bool', _('Profile the actions'
+                              '\nFor the slowness reports, .pstats files are written to the Zim cache folder.'), False),
         ('button_monday', 'bool', _('Monday button'), True),
         ('button_next_monday', 'bool', _('Next Monday button (Monday in two weeks)'), True),
         ('button_next_month', 'bool', _('Next month button (1st next month)'), True),
@@ -115,29 +220,162 @@ See `File / Properties / Google Tasks` for options, `Tools / Google Tasks` for a
             if bullet in [CHECKED_BOX, UNCHECKED_BOX]:
                 controller: GoogletasksController = self.notebook.plugin_googletasks
                 task_id = controller.get_task_id(line, buffer=self)
-                if task_id and not controller.task_checked(task_id, bullet):
-                    return
+                if task_id:
+                    # the server is updated in the background, the bullet gets reverted if it fails
+                    controller.status_queue.put(task_id, bullet, buffer=self)
             self.set_bullet_original(line, bullet, indent=indent)
 
 
 class GoogletasksCommand(NotebookCommand, GtkCommand):
-    """Class to handle "zim --plugin googletasks" """
-    arguments = ('[NOTEBOOK]',)
+    """Class to handle "zim --plugin googletasks"
+
+    More notebooks may be given (or --all of them), a task list they share is downloaded only once.
+    Exit status is 0 if every notebook succeeded, 1 otherwise; --json prints the result of every notebook.
+    """
+    arguments = ('[NOTEBOOK...]',)
+    options = (
+        ('all', 'a', 'Process all the known notebooks'),
+        ('sync-only', '', 'Sync tasks status only, do not import'),
+        ('lists-only', '', 'Refresh task lists only, do not import'),
+        ('json', '', 'Print the result of every notebook as JSON'),
+        ('stats', '', 'Print statistics of the recent operations instead of importing'),
+        ('daemon', '', 'Keep running and import new tasks as they appear'),
+    )
 
     def run(self):
-        ntb_name = self.get_notebook_argument()[0] or self.get_default_or_only_notebook()
-        ntb, _ = build_notebook(ntb_name)
-        preferences = ConfigManager().get_config_dict('preferences.conf')['GoogletasksPlugin'].dump()
-        GoogletasksController(notebook=ntb, preferences=preferences).fetch(True)  # add new lines
+        notebooks = [build_notebook(info)[0] for info in self._notebook_infos()]
+        enabled = any(self._preferences(ntb)["profile"] for ntb in notebooks)
+        mode = next((opt for opt in ("daemon", "stats", "sync-only", "lists-only") if self.opts.get(opt)), "fetch")
+        with profiled("command-" + mode, enabled):
+            self._run(notebooks)
+
+    def _run(self, notebooks):
+        if self.opts.get('stats'):
+            for ntb in notebooks:
+                if len(notebooks) > 1:
+                    print(f"{ntb.name}:")
+                print(Stats(Path(str(ntb.cache_dir), STATS_FILE)).summary())
+            return
+        controllers = [GoogletasksController(notebook=ntb, preferences=self._preferences(ntb)) for ntb in notebooks]
+        if self.opts.get('daemon'):
+            if daemon_request({"cmd": "status"}, timeout=1):
+                raise UsageError(f"Another daemon is running at {DAEMON_SOCKET}")
+            SyncDaemon(controllers).run()
+            return
+
+        report = []
+        lists_refreshed = self._share_task_lists(controllers, force=self.opts.get('lists-only'))
+        if self.opts.get('lists-only'):
+            report = [{"notebook": c.notebook.name, "ok": lists_refreshed} for c in controllers]
+        else:
+            for controller in controllers:  # pending changes first, so that the downloaded tasks are not outdated
+                controller.flush_outbox()
+            self._prefetch(controllers)
+            for controller in controllers:
+                result = {"notebook": controller.notebook.name}
+                try:
+                    if self.opts.get('sync-only'):
+                        result["ok"] = controller.sync_bullets_from_server() is not False
+                    else:
+                        new_tasks = controller.fetch(True)  # add new lines
+                        result["ok"], result["new_tasks"] = new_tasks is not False, new_tasks or 0
+                except Exception as e:
+                    logger.exception(f"[Googletasks] {controller.notebook.name} failed")
+                    result["ok"], result["error"] = False, str(e)
+                report.append(result)
+
+        if self.opts.get('json'):
+            print(json.dumps({"ok": all(r["ok"] for r in report), "notebooks": report}, indent=2))
+        if not all(r["ok"] for r in report):
+            sys.exit(1)
+
+    def _notebook_infos(self):
+        if self.opts.get('all'):
+            return list(get_notebook_list())
+        if len(self.args) > 1:
+            infos = [resolve_notebook(arg) for arg in self.args]
+            for arg, info in zip(self.args, infos):
+                if not info:
+                    raise UsageError(f"Cannot find notebook {arg}")
+            return infos
+        return [self.get_notebook_argument()[0] or self.get_default_or_only_notebook()]
+
+    @staticmethod
+    def _preferences(ntb):
+        """ The plugin notebook properties of `ntb`, completed by the global plugin preferences and the defaults. """
+        preferences = {p[0]: p[3] for p in GoogletasksPlugin.plugin_notebook_properties}
+        preferences.update(ConfigManager().get_config_dict('preferences.conf')['GoogletasksPlugin'].dump())
+        preferences.update(ntb.config['GoogletasksPlugin'].dump())
+        return preferences
+
+    @staticmethod
+    def _share_task_lists(controllers, force=False):
+        """ Refresh the task lists once (if a notebook misses one or if forced) and give them to every notebook.
+        Returns False if the refresh failed. """
+        missing = any(title not in ("", "@default") and title not in c.cache.load().lists
+                      for c in controllers for title in c.targets())
+        if not controllers or not (force or missing):
+            return True
+        first = controllers[0]
+        if first.refresh_task_lists() is False:
+            return False
+        for controller in controllers[1:]:
+            controller.cache.lists = dict(first.cache.lists)
+            controller.cache.save()
+        return True
+
+    @staticmethod
+    def _prefetch(controllers):
+        """ Download the changes of every task list used by more notebooks once.
+        The download starts from the least recent refresh among them, so it serves all of them. """
+        users = defaultdict(list)
+        for controller in controllers:
+            for title in controller.targets():
+                try:
+                    tasklist = controller.tasklist_id(title)
+                except LookupError:
+                    continue  # reported by the notebook itself
+                if controller not in users[tasklist]:
+                    users[tasklist].append(controller)
+
+        prefetched = {}
+        for tasklist, shared in users.items():
+            if len(shared) < 2:
+                continue
+            synced = [c.store.synced(tasklist) for c in shared]
+            updated_min = None if None in synced else min(synced)
+            first = shared[0]
+            now = first.synced_now()
+            try:
+                tasks = list(first.download_changes(first.calendar_api.get_service(), tasklist, updated_min))
+            except (httplib2.HttpLib2Error, OSError, errors.Error) as e:
+                logger.warning(f"[Googletasks] Cannot download task list {tasklist} for more notebooks: {e}")
+                continue  # every notebook will try on its own
+            prefetched[tasklist] = tasks, now
+        for controller in controllers:
+            controller.prefetched = prefetched
 
 
 class GoogleCalendarApi:
     permission_write_file = os.path.join(WORKDIR, 'googletasks_oauth_write.json')
     permission_read_file = os.path.join(WORKDIR, 'googletasks_oauth.json')
+    discovery_file = os.path.join(WORKDIR, 'googletasks_discovery.json')
+
+    http_cache = None
+    "HttpCache shared by all the Http objects."
+
+    @staticmethod
+    def http_factory():
+        """ Builds Http objects for the services, benchmarks/fake_tasks_api.py replaces it. """
+        if not GoogleCalendarApi.http_cache:
+            GoogleCalendarApi.http_cache = HttpCache(Path(HTTP_CACHE_DIR))
+        return httplib2.Http(cache=GoogleCalendarApi.http_cache, timeout=REQUEST_TIMEOUT)
+    _pool = {}
+    """{(scope, thread): (credentials mtime, service)} Shared by all the windows, rebuilt if credentials change.
+    A new thread (ex: of a job) takes over the service of a finished one, with its Http connection kept alive."""
+    _pool_lock = threading.Lock()
 
     def __init__(self, controller):
-        self.credential_path = None
-        self.scope = None
         self.controller: GoogletasksController = controller
 
     @staticmethod
@@ -150,17 +388,54 @@ class GoogleCalendarApi:
     def get_service(self, info=None, write_access=False):
         if info:
             self.controller.info(info)  # strangely, this info is not seen in the status bar
+        # locals, not attributes: the threads of the window and the jobs share this object
         if write_access:
-            self.credential_path = GoogleCalendarApi.permission_write_file
-            self.scope = 'https://www.googleapis.com/auth/tasks'
+            credential_path = GoogleCalendarApi.permission_write_file
+            scope = 'https://www.googleapis.com/auth/tasks'
         else:
-            self.credential_path = GoogleCalendarApi.permission_read_file
-            self.scope = 'https://www.googleapis.com/auth/tasks.readonly'
-        credentials = self.get_credentials()
-        http = credentials.authorize(httplib2.Http())
-        return discovery.build('tasks', 'v1', http=http)
+            credential_path = GoogleCalendarApi.permission_read_file
+            scope = 'https://www.googleapis.com/auth/tasks.readonly'
+        key = scope, threading.current_thread()  # httplib2.Http is not thread safe, every thread has its own
+        with self._pool_lock:
+            if key not in self._pool:
+                finished = next((k for k in self._pool if k[0] == scope and not k[1].is_alive()), None)
+                if finished:
+                    self._pool[key] = self._pool.pop(finished)
+            mtime, service = self._pool.get(key, (None, None))
+            if not service or mtime != self._credentials_mtime(credential_path):
+                # the Http object is kept with the service so that its connections are kept alive
+                http = self.get_credentials(credential_path, scope).authorize(InstrumentedHttp(self.http_factory()))
+                service = self._build(http)
+                self._pool[key] = self._credentials_mtime(credential_path), service
+        return service
+
+    @classmethod
+    def invalidate(cls):
+        """ Forget the built services, ex: when a connection failed. Next `get_service` call rebuilds them. """
+        with cls._pool_lock:
+            cls._pool.clear()
+
+    @staticmethod
+    def _credentials_mtime(credential_path):
+        try:
+            return os.path.getmtime(credential_path)
+        except OSError:
+            return None
+
+    def _build(self, http):
+        """ Build the service from the locally stored discovery document. Download the document only once. """
+        try:
+            return discovery.build_from_document(Path(self.discovery_file).read_text(), http=http)
+        except (OSError, ValueError):
+            pass
+        service = discovery.build('tasks', 'v1', http=http)
+        try:
+            Path(self.discovery_file).write_text(json.dumps(service._rootDesc))
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Cannot store the discovery document: {e}")
+        return service
 
-    def get_credentials(self):
+    def get_credentials(self, credential_path, scope):
         """Gets valid user credentials from storage.
 
         If nothing has been stored, or if the stored credentials are invalid,
@@ -169,19 +444,211 @@ class GoogleCalendarApi:
         Returns:
             Credentials, the obtained credential.
         """
-        store = Storage(self.credential_path)
+        store = oauth2client_file.Storage(credential_path)
         credentials = store.get()
         if not credentials or credentials.invalid:
-            flow = client.flow_from_clientsecrets(CLIENT_SECRET_FILE, self.scope)
+            flow = client.flow_from_clientsecrets(CLIENT_SECRET_FILE, scope)
             flow.user_agent = APPLICATION_NAME  # Googletasks2zimPlugin.plugin_info["name"]
             argv = sys.argv
             sys.argv = sys.argv[:1]  # tools.run_flow unfortunately parses arguments and would die from any zim args
             credentials = tools.run_flow(flow, store)
-            self.controller.info('Storing credentials to ' + self.credential_path)
+            self.controller.info('Storing credentials to ' + credential_path)
             sys.argv = argv
         return credentials
 
 
+class InstrumentedHttp:
+    """ Wraps httplib2.Http to count requests and transferred bytes in the open `Stats` spans. """
+
+    def __init__(self, http):
+        self._http = http
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        response, content = self._http.request(uri, method, body, headers, *args, **kwargs)
+        Stats.count("requests")
+        if getattr(response, "fromcache", False):  # revalidated by 304 Not Modified, the body was not transferred
+            Stats.count("cache_hits")
+            Stats.count("bytes", self._size(body))
+        else:
+            Stats.count("bytes", self._size(body) + self._size(content))
+        return response, content
+
+    @staticmethod
+    def _size(data):
+        """ Bytes of the body, given as str or bytes. """
+        return len(data.encode("utf-8")) if isinstance(data, str) else len(data or b"")
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+
+class RequestScheduler:
+    """ Every API request goes through, so that the requests-per-second budget is kept across the threads
+    and the notebooks, and the requests failing with a retryable status (429, 5xx) are retried
+    with exponential backoff and jitter, respecting the Retry-After header.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = float("inf")  # the bucket starts full
+        self._updated = perf_counter()
+        self._paused_until = 0
+        "perf_counter() time; the server asked us to wait"
+
+    def acquire(self, n=1, rate=10):
+        """ Wait until `n` requests fit into the budget of `rate` requests per second. """
+        while True:
+            with self._lock:
+                now = perf_counter()
+                self._tokens = min(rate, self._tokens + (now - self._updated) * rate)
+                self._updated = now
+                # more requests than the bucket holds (a batch) wait for the full bucket and go into debt
+                wait = max(self._paused_until - now, (min(n, rate) - self._tokens) / rate)
+                if wait <= 0:
+                    self._tokens -= n
+                    return
+            self._sleep(wait)
+
+    def call(self, func, n=1, rate=10):
+        """ Call `func` executing `n` requests within the budget, retry it on a retryable HttpError. """
+        for attempt in count():
+            self.acquire(n, rate)
+            try:
+                return func()
+            except errors.HttpError as e:
+                if not self.retryable(e) or attempt >= MAX_RETRIES:
+                    raise
+                logger.info(f"[Googletasks] Request failed with {e.resp.status}, retrying")
+                Stats.count("retries")
+                self.backoff(attempt, e.resp)
+
+    @staticmethod
+    def retryable(exception):
+        return getattr(getattr(exception, "resp", None), "status", None) in RETRYABLE_STATUSES
+
+    def backoff(self, attempt, response=None):
+        """ Wait before the next attempt. A Retry-After the server sent pauses all the requests. """
+        delay = self.retry_after(response)
+        if delay is None:
+            delay = min(MAX_BACKOFF, BACKOFF * 2 ** attempt)
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        else:
+            with self._lock:
+                self._paused_until = max(self._paused_until, perf_counter() + delay)
+        self._sleep(delay)
+
+    @staticmethod
+    def retry_after(response):
+        """ Seconds from the Retry-After header (delta-seconds or HTTP-date) or None. """
+        value = response.get("retry-after") if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            pass
+        try:
+            return max(0, (parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _sleep(seconds):
+        """ Sleep in short steps so that a background job can be cancelled meanwhile. """
+        deadline = perf_counter() + seconds
+        while perf_counter() < deadline:
+            Job.progress()
+            sleep(max(0, min(deadline - perf_counter(), 0.5)))
+
+
+def timed(method):
+    """ Decorator of GoogletasksController methods, measures them in `self.stats`. """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.stats.span(method.__name__, tasklist=self.preferences["tasklist"] or "@default"):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def in_main_loop(method):
+    """ Decorator of GoogletasksController methods touching the GUI (ex: the buffer of the shown page).
+    When called from a background job, the method runs in the GTK main loop and the job waits for the result.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.window or threading.current_thread() is threading.main_thread():
+            return method(self, *args, **kwargs)
+        done = threading.Event()
+        result = {}
+
+        def call():
+            try:
+                result["value"] = method(self, *args, **kwargs)
+            except Exception as e:
+                result["error"] = e
+            done.set()
+            return False
+
+        GLib.idle_add(call)
+        done.wait()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    return wrapper
+
+
+_profiling = threading.local()
+
+
+@contextmanager
+def profiled(name, enabled=False):
+    """ Profile the block by cProfile if `enabled` or PROFILE_ENV is set.
+    The profile is written to PROFILES_DIR/<time>-<name>.pstats (see it by `python -m pstats`, snakeviz,
+    or convert it to a flame graph by flameprof), only the PROFILES_KEEP newest files are kept.
+    """
+    if not (enabled or os.environ.get(PROFILE_ENV)) or getattr(_profiling, "active", False):
+        yield  # not enabled or nested in a profiled block
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:  # another profiler is active in this thread
+        yield
+        return
+    _profiling.active = True
+    try:
+        yield
+    finally:
+        profile.disable()
+        _profiling.active = False
+        folder = Path(PROFILES_DIR)
+        try:
+            folder.mkdir(parents=True, exist_ok=True)
+            file = folder / f"{datetime.datetime.now():%Y%m%d-%H%M%S-%f}-{name}.pstats"
+            profile.dump_stats(str(file))
+            logger.info(f"[Googletasks] Profile written to {file}")
+            for old in sorted(folder.glob("*.pstats"))[:-PROFILES_KEEP]:
+                old.unlink()
+        except OSError as e:
+            logger.warning(f"[Googletasks] Cannot write profile: {e}")
+
+
+def profiled_action(method):
+    """ Decorator of GoogletasksWindow actions doing their work in the main loop, see `profiled`.
+    (Actions running as jobs are profiled by `GoogletasksWindow._run_job`.) """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with profiled(method.__name__, self.controller.preferences["profile"]):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 def monkeypatch_method(cls):
     """ Decorator used for extend features of a method
         If it seems the methods has been already monkey patched (func.__name__ + "_original" exists), it does nothing.
@@ -211,14 +678,75 @@ class GoogletasksWindow(MainWindowExtension):
         print("test")
 
     def __init__(self, plugin, window):
-        controller = self.controller = GoogletasksController(
+        self.controller = GoogletasksController(
             window=window,
             preferences=plugin.notebook_properties(window.notebook)
         )
         MainWindowExtension.__init__(self, plugin, window)  # super(WindowExtension, self).__init__(*args, **kwargs)
+        self.controller.mark_open()
+
+        self._jobs = {}
+        "{action name: Job}"
+        self._polling = True
+        self._poll_interval = POLL_MIN
+        self._poll_source = GLib.timeout_add_seconds(POLL_MIN, self._daemon_poll)
 
         if self.plugin.preferences['startup_check']:
-            controller.fetch()
+            # the window is displayed first, Google API libraries get imported no sooner than with the first request
+            GLib.idle_add(self._startup_fetch)
+
+    def teardown(self):
+        self.controller.mark_open(False)
+        self._polling = False
+        if self._poll_source:
+            GLib.source_remove(self._poll_source)
+            self._poll_source = None
+
+    def _daemon_poll(self):
+        """ While the daemon runs, import the new tasks in its stead: it leaves the notebook open in Zim be.
+        A quiet job, the interval adapts like the daemon's one. """
+        self._poll_source = None
+        job = self._jobs.get("import_tasks")
+        if job and job.running:  # the user imports right now
+            self._schedule_poll()
+        else:
+            self._jobs["import_tasks"] = Job(_("Importing new tasks"), self._poll, parent=self.window, quiet=True)
+        return False  # the next poll is scheduled when this one is done
+
+    def _poll(self):
+        new_tasks = None
+        try:
+            if daemon_request({"cmd": "status"}, timeout=1):
+                with profiled("import_tasks", self.controller.preferences["profile"]):
+                    new_tasks = self.controller.fetch(force=True)
+        finally:
+            self._poll_interval = POLL_MIN if new_tasks or new_tasks is None \
+                else min(POLL_MAX, self._poll_interval * 2)
+            GLib.idle_add(self._schedule_poll)
+
+    def _schedule_poll(self):
+        if self._polling and self._poll_source is None:
+            self._poll_source = GLib.timeout_add_seconds(max(1, round(poll_delay(self._poll_interval))),
+                                                         self._daemon_poll)
+        return False
+
+    def _startup_fetch(self):
+        self._run_job("import_tasks", _("Importing new tasks"), self.controller.fetch)
+        return False  # do not repeat the idle callback
+
+    def _run_job(self, name, title, func, *args, **kwargs):
+        """ Run the action in a background thread unless it is already running. """
+        job = self._jobs.get(name)
+        if job and job.running:
+            self.controller.info(f"{title} is already running")
+            job.show()
+            return
+
+        def run():
+            with profiled(name, self.controller.preferences["profile"]):
+                func(*args, **kwargs)
+
+        self._jobs[name] = Job(title, run, parent=self.window)
 
     def _add_actions(self, uimanager):
         """ Set up menu items.
@@ -264,7 +792,9 @@ class GoogletasksWindow(MainWindowExtension):
                                 <menu action='googletasks_menu'>
                                     <menuitem action='import_tasks'/>
                                     <menuitem action='sync_status'/>
+                                    <menuitem action='push_edits'/>
                                     <menuitem action='send_as_task'/>
+                                    <menuitem action='send_as_tasks'/>
                                     <menuitem action='add_new_task'/>
                                     <menuitem action='import_history'/>
                                     ''' + "\n".join(permissions) + '''
@@ -285,6 +815,7 @@ class GoogletasksWindow(MainWindowExtension):
             self._uimanager.add_ui_from_string(xml)
 
     @action(_('_Task from cursor or selection...'), accelerator='<ctrl><alt><shift>g')  # T: menu item
+    @profiled_action
     def send_as_task(self):
         """ cut current text and call send to tasks dialog """
         buffer = self.window.pageview.textview.get_buffer()
@@ -294,17 +825,17 @@ class GoogletasksWindow(MainWindowExtension):
             line_i = buffer.get_insert_iter().get_line()
             start_iter = buffer.get_iter_at_line(line_i)
 
-            while True:
-                line_i += 1
-                s = None
-                try:
-                    s = self.controller.readline(line_i, buffer)
-                finally:
-                    if (not s or not s.strip() or s.startswith("\n") or
-                            s.startswith("\xef\xbf\xbc ") or  # begins with a checkbox
-                            TASK_ANCHOR_SYMBOL in s):
-                        line_i -= 1
-                        break
+            line_iter = start_iter.copy()
+            while line_iter.forward_line():  # one iterator walks the lines, their task IDs come from the AnchorIndex
+                end_iter = line_iter.copy()
+                if not end_iter.ends_line():
+                    end_iter.forward_to_line_end()
+                s = buffer.get_slice(line_iter, end_iter, include_hidden_chars=True)
+                if (not s.strip() or
+                        s.startswith("\xef\xbf\xbc ") or  # begins with a checkbox
+                        self.controller.get_task_id(line_iter.get_line(), buffer)):
+                    break
+                line_i = line_iter.get_line()
 
             end_iter = buffer.get_iter_at_line(line_i)
             end_iter.forward_to_line_end()
@@ -314,6 +845,28 @@ class GoogletasksWindow(MainWindowExtension):
             task = self.controller.read_task_from_selection(buffer)
             self.add_new_task(task=task)
 
+    @action(_('Tasks from _checkbox lines of selection'))  # T: menu item
+    @profiled_action
+    def send_as_tasks(self):
+        """ submit every checkbox line of the selection as a task and link the lines to the created tasks """
+        buffer = self.window.pageview.textview.get_buffer()
+        bounds = buffer.get_selection_bounds()
+        if not bounds:
+            self.controller.info("Select the checkbox lines first")
+            return
+        items = self.controller.read_tasks_from_selection(buffer)
+        tasks = [item[1] for item in items if item[0] == "task"]
+        if not tasks:
+            self.controller.info("No checkbox line in the selection")
+            return
+        # the page may change while the tasks are being submitted, marks keep the place
+        start, end = buffer.create_mark(None, bounds[0], True), buffer.create_mark(None, bounds[1], False)
+
+        def submit():
+            self.controller.replace_tasks(buffer, start, end, items, self.controller.submit_tasks(tasks))
+
+        self._run_job("send_as_tasks", _("Submitting tasks"), submit)
+
     @action(_('_Add new task...'))  # T: menu item
     def add_new_task(self, task=None):
         # gui window
@@ -327,32 +880,39 @@ class GoogletasksWindow(MainWindowExtension):
             .setup()
 
     @action(_('_Claim read only access'))  # T: menu item
+    @profiled_action
     def permission_readonly(self):
         self.controller.calendar_api.get_service()
 
     @action(_('_Claim write access'))  # T: menu item
+    @profiled_action
     def permission_write(self):
         self.controller.calendar_api.get_service(write_access=True)
 
     @action(_('_Import new tasks'), accelerator='<ctrl><alt>g')  # T: menu item
     def import_tasks(self):
-        if self.controller.preferences["auto_sync"]:
-            self.sync_status()
-        self.controller.fetch(force=True)
+        self._run_job("import_tasks", _("Importing new tasks"), self._import, force=True)
 
     @action(_('_Import all non-completed even already imported tasks from the past'))  # T: menu item
     def import_history(self):
+        self._run_job("import_history", _("Importing tasks history"), self._import, all_history=True)
+
+    def _import(self, **kwargs):
         if self.controller.preferences["auto_sync"]:
-            self.sync_status()
-        self.controller.fetch(all_history=True)
+            self.controller.sync_bullets_from_server()
+        self.controller.fetch(**kwargs)
 
     @action(_('_Sync tasks status from server'))  # T: menu item
     def sync_status(self):
-        self.controller.sync_bullets_from_server()
+        self._run_job("sync_status", _("Syncing tasks status"), self.controller.sync_bullets_from_server)
+
+    @action(_('Send _edits of the tasks on page'))  # T: menu item
+    def push_edits(self):
+        self._run_job("push_edits", _("Sending edits of the tasks"), self.controller.push_page_edits)
 
     @action(_('_Refresh task lists'))  # T: menu item
     def refresh_task_lists(self):
-        self.controller.refresh_task_lists()
+        self._run_job("refresh_task_lists", _("Refreshing task lists"), self.controller.refresh_task_lists)
 
 
 class GoogletasksNewTaskDialog(Dialog):
@@ -383,6 +943,10 @@ class GoogletasksNewTaskDialog(Dialog):
 
         # date field
         self.input_due = InputEntry(allow_empty=False)
+        if "due" not in self.task and self.task.get("id"):  # the task is known locally, prefill its due date
+            stored = self.controller.store.get(self.task["id"])
+            if stored and stored["due"]:
+                self.task["due"] = stored["due"]
         try:
             s = self.controller.get_time(mode="date-only", from_string=self.task["due"], past_dates=False)
         except (ValueError, KeyError):  # task["due"] is not set or is in past
@@ -444,8 +1008,6 @@ class GoogletasksNewTaskDialog(Dialog):
             self.input_title.set_text(self.task["title"])
         if "notes" in self.task:
             self.input_notes.get_buffer().set_text(self.task["notes"])
-        if "due" in self.task:
-            logger.error("Not yet implemented")  # XX
 
         # display window
         self.show_all()
@@ -464,7 +1026,7 @@ class GoogletasksNewTaskDialog(Dialog):
         if next_monday:
             d = next_weekday(d, 0)  # 0 = Monday, 1=Tuesday, 2=Wednesday...
         if relative_delta:
-            d += relativedelta(**relative_delta)
+            d += dateutil_relativedelta.relativedelta(**relative_delta)
         return self.controller.get_time(use_date=d, mode="date-only")
 
     def update_date(self, _):
@@ -501,16 +1063,23 @@ class GoogletasksNewTaskDialog(Dialog):
             return False
         self._load_task()
         self.destroy()  # immediately close (so that we wont hit Ok twice)
-        if not self.controller.submit_task(task=self.task):
-            self.do_response_cancel()
+        task, controller = self.task, self.controller
+
+        def submit():  # the retries may wait for long, not in the main loop
+            submitted = False
+            try:
+                with profiled("submit_task", controller.preferences["profile"]):
+                    submitted = controller.submit_task(task=task)
+            finally:
+                if not submitted:
+                    controller.restore_task(task)
+
+        Job(_("Submitting task"), submit, parent=controller.window)
         return True
 
     def do_response_cancel(self):
         """ something failed, restore original text in the zim-page """
-        text = self.controller.get_task_text(self.task, self.controller.preferences["include_start_date"])
-        if text:
-            buffer = self.controller.window.pageview.textview.get_buffer()
-            buffer.insert_parsetree_at_cursor(Parser().parse(text))
+        self.controller.restore_task(self.task)
         self.destroy()
 
     # def postpone(self, _, number):
@@ -526,6 +1095,10 @@ class GoogletasksNewTaskDialog(Dialog):
 
 
 class GoogletasksController:
+    _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="googletasks-fetch")
+    "Shared by all the windows so that its threads keep their pooled services between imports."
+    scheduler = RequestScheduler()
+    "Shared by all the notebooks, the API quota is per user."
 
     def __init__(self, window: MainWindow | None = None, notebook=None, preferences=None):
         self.window = window
@@ -537,24 +1110,87 @@ class GoogletasksController:
         self.notebook.plugin_googletasks = self
 
         self.cache = Cache(Path(str(self.notebook.cache_dir), CACHE_FILE)).load()
+        self.stats = Stats(Path(str(self.notebook.cache_dir), STATS_FILE))
         self.calendar_api = GoogleCalendarApi(self)
+        self.status_queue = StatusQueue(self)
+        self.outbox = Outbox(Path(str(self.notebook.cache_dir), OUTBOX_FILE))
+        self._outbox_lock = threading.Lock()
+        self.store = TaskStore(Path(str(self.notebook.cache_dir), STORE_FILE))
+        self.prefetched = {}
+        "{task list ID: (tasks, synced)} downloaded once for more notebooks by GoogletasksCommand"
+        self.notebook.connect('stored-page', lambda _, page: self._index_page(page))
+
+    def mark_open(self, is_open=True):
+        """ Tell a daemon serving the notebook that the window has it open. """
+        marker = Path(str(self.notebook.cache_dir), f"{OPEN_FILE}.{os.getpid()}.{id(self)}")
+        if is_open:
+            marker.touch()
+        else:
+            marker.unlink(missing_ok=True)
+
+    def open_in_zim(self):
+        """ True if a running Zim window has the notebook open, see `mark_open`. """
+        for marker in Path(str(self.notebook.cache_dir)).glob(OPEN_FILE + ".*"):
+            try:
+                os.kill(int(marker.name[len(OPEN_FILE) + 1:].split(".")[0]), 0)
+            except (ValueError, ProcessLookupError):
+                marker.unlink(missing_ok=True)  # left by a Zim that did not stop cleanly
+                continue
+            except PermissionError:  # the process exists
+                pass
+            return True
+        return False
 
     @property
     def tasklist(self):
         """ Returns task list ID from cache (or fetches new one).
         If task list ID cannot be fetched, raise LookupError."""
-        # we have to pass ID or @default as task list
-        list_title = self.preferences["tasklist"]
+        return self.tasklist_id(self.preferences["tasklist"])
+
+    def tasklist_id(self, list_title):
+        """ Returns ID of the task list titled `list_title` (empty = default). Raises LookupError. """
         if not list_title or list_title == "@default":
             # It is more user friendly to let the parameter empty for the default task list.
-            # Plus, the string '@default' is never in the cache.
-            return "@default"
+            return self.default_tasklist_id()
         if list_title not in self.cache.lists:
             self.refresh_task_lists()
             if list_title not in self.cache.lists:
                 raise LookupError(f"Cannot identify task list {list_title}")
         return self.cache.lists[list_title]
 
+    def default_tasklist_id(self):
+        """ Returns the real ID of the default task list (not its alias '@default') so that its tasks are stored
+        and marked imported under the same key, whether the list is chosen by its title or not.
+        Raises LookupError. """
+        if not self.cache.default_list:
+            try:
+                service = self.calendar_api.get_service(info="Identifying the default task list")
+                tasklist = self._execute(service.tasklists().get(tasklist="@default"))["id"]
+            except (httplib2.HttpLib2Error, OSError, errors.Error) as e:
+                if not isinstance(e, errors.Error):
+                    self.calendar_api.invalidate()
+                raise LookupError(f"Cannot identify the default task list: {e}")
+            # the former versions kept the tasks of the default list under the alias
+            self.store.rename_tasklist("@default", tasklist)
+            self.cache.rename_tasklist("@default", tasklist)
+            self.cache.default_list = tasklist
+            self.cache.save()
+        return self.cache.default_list
+
+    def targets(self):
+        """ Returns {task list title: page name} to be imported, the main `tasklist` first.
+        Empty title stands for the default list, empty page name for the homepage. """
+        targets = {self.preferences["tasklist"]: self.preferences["page"] or ""}
+        for pair in (self.preferences["tasklist_pages"] or "").split(";"):
+            if not pair.strip():
+                continue
+            title, _, page = pair.partition("=")
+            if not _:
+                logger.warning(f"[Googletasks] Ignoring {pair.strip()}, expected Task list=Page")
+                continue
+            targets.setdefault(title.strip(), page.strip())
+        return targets
+
     def change_task_list_closure(self, title):
         def _(_):
             self.preferences["tasklist"] = title
@@ -562,29 +1198,23 @@ class GoogletasksController:
 
         return _
 
+    @timed
     def task_checked(self, task_id, bullet):
         """ un/mark task on Google server """
-        task = {"status": "completed" if bullet is CHECKED_BOX else "needsAction"}
-        service = self.calendar_api.get_service(write_access=True,
-                                                info=f"Marking task ID {task_id} as {task['status']}")
-
-        try:
-            if bullet is CHECKED_BOX:  # small patch will be sufficient
-                service.tasks().patch(tasklist=self.tasklist, task=task_id, body=task).execute()
-            else:  # we need to delete the automatically generated completed field, need to do a whole update
-                task = service.tasks().get(tasklist=self.tasklist, task=task_id).execute()
-                task.pop("completed", None)
-                task["status"] = "needsAction"
-                service.tasks().update(tasklist=self.tasklist, task=task_id, body=task).execute()
-        except LookupError as e:
-            self.info(e)
-            return False
-        except Exception as e:
-            self.info(f'Error in communication while un/checking: {e}')
+        task = self.status_body(bullet is CHECKED_BOX)
+        if not self._upload(task, task_id, info=f"Marking task ID {task_id} as {task['status']}",
+                            error="Error in communication while un/checking", on_page=True):
             return False
         self.info(f'Marked as {task["status"]}')
         return True
 
+    @staticmethod
+    def status_body(completed):
+        if completed:
+            return {"status": "completed"}
+        return {"status": "needsAction", "completed": None}  # patch deletes the automatically generated completed field
+
+    @timed
     def submit_task(self, task=None):
         """ Upload task to Google server """
         if task is None:
@@ -592,24 +1222,153 @@ class GoogletasksController:
         if "due" not in task:  # fallback - default is to postpone the task by a day
             task["due"] = self.get_time(add_days=1, mode="morning")
 
-        service = self.calendar_api.get_service(write_access=True, info=f"Submitting task {task.get('title')}")
+        if not self._upload(task, task.get("id"), info=f"Submitting task {task.get('title')}",
+                            error="Error in communication while sumitting"):
+            return False
+        self.info("Task '{}' {}.".format(task["title"], "updated" if "id" in task else "created"))
+        return True
 
-        # noinspection PyBroadException
+    @in_main_loop
+    def restore_task(self, task):
+        """ Put the task cut from the page back at the cursor (its submission failed or was cancelled). """
+        text = self.get_task_text(task, self.preferences["include_start_date"])
+        if text:
+            buffer = self.window.pageview.textview.get_buffer()
+            buffer.insert_parsetree_at_cursor(Parser().parse(text))
+
+    @timed
+    def submit_tasks(self, tasks):
+        """ Upload new tasks to Google server by batch requests.
+        When the server is not reachable, the tasks are stored to the outbox and sent later.
+        :return: list of the created tasks, None in place of a refused one; a task stored to the outbox is returned
+            as it is (with no ID). None if the task list is unknown.
+        """
         try:
-            if "id" in task:
-                service.tasks().patch(tasklist=self.tasklist, task=task["id"], body=task).execute()
-                self.info("Task '{}' updated.".format(task["title"]))
-            else:
-                service.tasks().insert(tasklist=self.tasklist, body=task).execute()
-                self.info("Task '{}' created.".format(task["title"]))
+            tasklist = self.tasklist
+        except LookupError as e:
+            self.info(e)
+            return None
+        self.flush_outbox()
+        for task in tasks:
+            task.setdefault("due", self.get_time(add_days=1, mode="morning"))
+
+        results = [None] * len(tasks)
+        sent = set()
+        try:
+            service = self.calendar_api.get_service(write_access=True, info=f"Submitting {len(tasks)} tasks")
+            requests = ((str(i), service.tasks().insert(tasklist=tasklist, body=task)) for i, task in enumerate(tasks))
+            for i, response, exception in self._batch(service, requests):
+                sent.add(int(i))
+                if exception:
+                    self.info(f"Task '{tasks[int(i)]['title']}' refused: {exception}")
+                else:
+                    self._written(tasklist, response, save=False)
+                    results[int(i)] = response
+            self.cache.save()
+        except errors.Error as e:
+            self.info(f'Error in communication while submitting: {e}')
+        except (httplib2.HttpLib2Error, OSError) as e:
+            self.calendar_api.invalidate()
+            for i, task in enumerate(tasks):
+                if i not in sent:
+                    self.outbox.add(tasklist, task, on_page=True)
+                    results[i] = task
+            self.info(f'Server not reachable ({e}), the tasks will be sent later.')
+        self.info(f"{sum(1 for task in results if task and 'id' in task)} of {len(tasks)} tasks created.")
+        return results
+
+    def _upload(self, body, task_id=None, info=None, error="Error in communication", on_page=False):
+        """ Patch the task or insert a new one if there is no `task_id`.
+        When the server is not reachable, the request is stored to the outbox and sent later.
+        :param on_page: The task stays on the page, it should not be imported again, see `_written`.
+        :return: False if the request was refused
+        """
+        try:
+            tasklist = self.tasklist
         except LookupError as e:
             self.info(e)
             return False
+
+        # noinspection PyBroadException
+        try:
+            self.flush_outbox()
+            service = self.calendar_api.get_service(write_access=True, info=info)
+            if task_id:
+                response = self._execute(service.tasks().patch(tasklist=tasklist, task=task_id, body=body))
+            else:
+                response = self._execute(service.tasks().insert(tasklist=tasklist, body=body))
+            self._written(tasklist, response, on_page)
+            if self.window:
+                daemon_request({"cmd": "poke"}, timeout=1)  # the daemon polls soon
+        except errors.Error as e:
+            self.info(f'{error}: {e}')
+            return False
+        except (httplib2.HttpLib2Error, OSError) as e:
+            self.calendar_api.invalidate()
+            self.outbox.add(tasklist, body, task_id, on_page)
+            self.info(f'Server not reachable ({e}), the change will be sent later.')
         except Exception as e:
-            self.info(f'Error in communication while sumitting: {e}')
+            self.info(f'{error}: {e}')
             return False
         return True
 
+    def _written(self, tasklist, response, on_page=True, save=True):
+        """ Store the task the server returned for our own change.
+        :param on_page: The task stays on the page (ex: it was checked), its new etag is recorded as imported
+            so that it is not imported again as changed on the server. A task cut from the page to be submitted
+            is to be imported again when due.
+        :param save: Save the cache now, else the caller saves it after more changes.
+        """
+        self.store.put(tasklist, response)
+        if on_page:
+            self.cache.mark_imported({**response, "tasklist": tasklist})
+            if save:
+                self.cache.save()
+
+    @timed
+    def flush_outbox(self):
+        """ Send the requests made while offline in a single batch.
+        :return: False if the server is still not reachable
+        """
+        if not self._outbox_lock.acquire(blocking=False):
+            return True  # another thread is just flushing
+        entries, count = [], 0
+        answered = set()
+        "indexes of the entries the server has answered, they leave the outbox even if the batch breaks later"
+        failed = []
+        try:
+            entries, count = self.outbox.entries()
+            if not entries:
+                return True
+            service = self.calendar_api.get_service(write_access=True,
+                                                    info=f"Sending {len(entries)} changes made offline")
+            requests = ((str(i), service.tasks().patch(tasklist=entry["tasklist"], task=entry["task"],
+                                                       body=entry["body"])
+                         if entry["task"] else service.tasks().insert(tasklist=entry["tasklist"], body=entry["body"]))
+                        for i, entry in enumerate(entries))
+            for i, response, exception in self._batch(service, requests):
+                entry = entries[int(i)]
+                answered.add(int(i))
+                if exception:
+                    if getattr(getattr(exception, "resp", None), "status", None) in RETRYABLE_STATUSES:
+                        failed.append(entry)
+                    else:
+                        self.info(f"Change made offline refused: {exception}")
+                else:
+                    self._written(entry["tasklist"], response, entry.get("on_page"), save=False)
+            return not failed
+        except (httplib2.HttpLib2Error, OSError) as e:
+            self.calendar_api.invalidate()
+            logger.debug(f"Outbox not sent: {e}")
+            return False
+        finally:
+            try:
+                if answered:
+                    self.cache.save()
+                    self.outbox.remove(count, keep=failed + [e for i, e in enumerate(entries) if i not in answered])
+            finally:
+                self._outbox_lock.release()
+
     @staticmethod
     def get_time(add_days=0, mode=None, from_string=None, use_date=None, past_dates=True):
         """ Time formatting function
@@ -618,24 +1377,15 @@ class GoogletasksController:
          We preferably use `use_date` object, else we parses from `from_string`. If `from_string` has missing info,
          it is taken from the default 2020-01-01, so ex: '2021-05' will be converted to '2021-05-01'
         """
-        dt_now = use_date if use_date else \
-            dateutil.parser.parse(from_string, default=datetime.datetime(2020, 1, 1)) if from_string else \
-            datetime.datetime.now()
+        dt_now = use_date if use_date else parse_time(from_string) if from_string else datetime.datetime.now()
         if add_days:
             dt_now += datetime.timedelta(add_days, 0)
-        if not past_dates and dt_now.isoformat()[:10] < datetime.datetime.now().isoformat()[:10]:
+        if not past_dates and dt_now.isoformat()[:10] < datetime.date.today().isoformat():
             # why isoformat? something with tzinfo
             raise ValueError
         if mode:
             try:
-                return {
-                    "object": lambda: dt_now,
-                    "date-only": lambda: dt_now.isoformat()[:10],
-                    "midnight": lambda: dt_now.isoformat()[:11] + "00:00:00.000Z",
-                    "morning": lambda: dt_now.isoformat()[:11] + "08:00:00.000Z",
-                    "last-sec": lambda: dt_now.isoformat()[:11] + "23:59:59.999Z",
-                    "day": lambda: dt_now.strftime("%A").lower()[:2]
-                }[mode]()
+                return TIME_MODES[mode](dt_now)
             except KeyError:
                 logger.error("Wrong time mode {}!".format(mode))
         return dt_now.isoformat()
@@ -649,26 +1399,96 @@ class GoogletasksController:
         # if self.window:
         #     self.window.statusbar.push(0, text)
 
-    def _read_task_list(self, due_min, show_completed=False, service=None):
-        """ In case of an error or no tasks found, informs user in the status bar and raises LookupError. """
+    def _paginate(self, method, **kwargs):
+        """ Yields items of a list() API method, following `nextPageToken` until all pages are read.
+        :param method: ex: `service.tasks().list`
+        """
+        page_token = None
+        while True:
+            Job.progress()
+            results = self._execute(method(maxResults=PAGE_SIZE, pageToken=page_token, **kwargs))
+            yield from results.get('items', [])
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+
+    def _execute(self, request):
+        """ Execute a single API request through the scheduler. """
+        with self.stats.span(getattr(request, "methodId", "request")):
+            return self.scheduler.call(request.execute, rate=self.preferences["requests_per_second"])
+
+    def _batch(self, service, requests):
+        """ Executes API requests by batches and yields their results.
+        :param requests: iterable of `(request_id, HttpRequest)`, request_id has to be unique
+        :return: generator of `(request_id, response, exception)`; exception is set when the single request failed
+            Single requests failing with a retryable status are retried with backoff first.
+        :raise: Whole batch failure (ex: httplib2.ServerNotFoundError) is raised.
+        """
+        requests = iter(requests)
+        while True:
+            chunk = list(islice(requests, BATCH_SIZE))
+            if not chunk:
+                break
+            for attempt in count():
+                Job.progress()
+                results = []
+                batch = service.new_batch_http_request(
+                    callback=lambda request_id, response, exception: results.append((request_id, response, exception)))
+                for request_id, request in chunk:
+                    batch.add(request, request_id=request_id)
+                with self.stats.span("batch"):
+                    self.scheduler.call(batch.execute, len(chunk), rate=self.preferences["requests_per_second"])
+                retry = {}
+                for request_id, response, exception in results:
+                    if exception and self.scheduler.retryable(exception) and attempt < MAX_RETRIES:
+                        retry[request_id] = exception
+                    else:
+                        yield request_id, response, exception
+                if not retry:
+                    break
+                Stats.count("retries", len(retry))
+                self.scheduler.backoff(attempt, max((e.resp for e in retry.values()),
+                                                    key=lambda resp: self.scheduler.retry_after(resp) or 0))
+                chunk = [(request_id, request) for request_id, request in chunk if request_id in retry]
+
+    @timed
+    def refresh_store(self, service=None, tasklist=None):
+        """ Download tasks changed on the server since the last refresh to the local store.
+        :param tasklist: ID, the main task list by default
+        In case of an error, raises LookupError. """
+        if not tasklist:
+            tasklist = self.tasklist  # self.tasklist property has problem, raises LookupError
+        if tasklist in self.prefetched:
+            tasks, synced = self.prefetched[tasklist]
+            self.store.update(tasklist, tasks, synced=synced)
+            return
+        if self.window:  # a running daemon refreshes the store we share with it, with its warm service
+            reply = daemon_request({"cmd": "refresh_store", "notebook": str(self.notebook.cache_dir),
+                                    "tasklist": tasklist})
+            if reply and reply["ok"]:
+                return
         if not service:
             service = self.calendar_api.get_service(info="Reading task list")
+        synced = self.synced_now()
         try:
-            results = service.tasks().list(maxResults=99,
-                                           tasklist=self.tasklist,
-                                           showCompleted=show_completed,
-                                           dueMin=due_min,
-                                           dueMax=self.get_time(add_days=1, mode="midnight")  # for format see #17
-                                           ).execute()
-        except (LookupError, httplib2.ServerNotFoundError, Error) as e:
-            # self.tasklist property has problem, raises LookupError
-            self.info(e)
-            raise LookupError
-        items = results.get('items', [])
-        if not items:
-            self.info('No tasks found.')
-            raise LookupError
-        return items
+            # downloaded before written, the other executor threads and the main loop may use the store meanwhile
+            tasks = list(self.download_changes(service, tasklist, self.store.synced(tasklist)))
+        except (httplib2.HttpLib2Error, OSError, errors.Error) as e:
+            if not isinstance(e, errors.Error):
+                self.calendar_api.invalidate()
+            raise LookupError(e)
+        self.store.update(tasklist, tasks, synced=synced)
+
+    def download_changes(self, service, tasklist, updated_min=None):
+        """ Yields the tasks of the list changed since `updated_min`, including the completed and deleted ones. """
+        return self._paginate(service.tasks().list, tasklist=tasklist, showCompleted=True, showHidden=True,
+                              showDeleted=True, updatedMin=updated_min)
+
+    @staticmethod
+    def synced_now():
+        """ Timestamp a refresh starting now should be stored with. """
+        # the server clock might slightly differ, let's ask for a bit more
+        return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(minutes=5)).isoformat()
 
     @staticmethod
     def get_task_text(task, include_due=False):
@@ -705,8 +1525,13 @@ class GoogletasksController:
             end = start
         return buffer.get_slice(start, end, include_hidden_chars=True)
 
+    @staticmethod
+    def get_task_id(line_i, buffer):
+        return AnchorIndex.of(buffer).get(line_i)
+
     @classmethod
-    def get_task_id(cls, line_i, buffer):
+    def read_task_id(cls, line_i, buffer):
+        """ Task ID the line links to, read from the buffer. """
         task_anchor_pos = cls.readline(line_i, buffer).find(TASK_ANCHOR_SYMBOL)
         if task_anchor_pos > -1:
             offset = task_anchor_pos + buffer.get_iter_at_line(line_i).get_offset()
@@ -746,6 +1571,77 @@ class GoogletasksController:
         buffer.delete(*buffer.get_selection_bounds())  # cuts the task
         return task
 
+    def read_tasks_from_selection(self, buffer):
+        """ Split the selection into tasks, one per top-level checkbox line, the following lines are its notes
+        (indented checkboxes included, they are kept as they are).
+        Start date (">2021-01-01") on a line before the first checkbox is shared by all the tasks,
+        start date on a checkbox line is for its task only.
+        :return: list of `("task", task, original lines)` and `("text", lines, None)`;
+            the lines already linked to a task or before the first checkbox are kept as text
+        """
+        lines = get_dumper("wiki").dump(buffer.get_parsetree(buffer.get_selection_bounds()))
+        items = []
+        shared_due = None
+        for line in lines:
+            match = checkboxRe.match(line)
+            if match and match[1]:  # nested in the previous line
+                match = None
+            if match and not taskAnchorTreeRe.match(line):
+                # [*] checked, [x] checked as not to be done
+                task = {"title": match[3].rstrip(), "status": "completed" if match[2] in "*x" else "needsAction"}
+                m = start_date_in_title.match(task["title"])
+                if m:
+                    task["title"] = (m[1] + m[4]).replace("_{////}", "").rstrip()
+                    task["due"] = self.get_time(from_string=m[2], mode="morning")
+                elif shared_due:
+                    task["due"] = shared_due
+                items.append(("task", task, [line]))
+            elif items and items[-1][0] == "task" and not match:  # notes of the task
+                task, original = items[-1][1:]
+                task["notes"] = task.get("notes", "") + line
+                original.append(line)
+            else:
+                if not items:
+                    m = start_date_in_title.match(line)
+                    if m:
+                        shared_due = self.get_time(from_string=m[2], mode="morning")
+                if items and items[-1][0] == "text":
+                    items[-1][1].append(line)
+                else:
+                    items.append(("text", [line], None))
+        for kind, task, original in items:
+            if kind == "task" and "notes" in task:
+                task["notes"] = task["notes"].rstrip("\n")
+        return items
+
+    @in_main_loop
+    def replace_tasks(self, buffer, start, end, items, results):
+        """ Replace the text between the marks by the task lines linked to the created tasks, in a single edit.
+        A task line keeps its checkbox (ex: [x]). The lines of a refused task are kept as they were.
+        """
+        if results is None:
+            results = []
+        results = iter(results)
+        text = ""
+        for kind, content, original in items:
+            if kind == "text":
+                text += "".join(content)
+                continue
+            task = next(results, None)
+            if task is None:
+                text += "".join(original)
+                continue
+            checkbox = checkboxRe.match(original[0])[2]
+            task_text = self.get_task_text(task, self.preferences["include_start_date"])[4:]  # without "[ ] "
+            text += f"[{checkbox}] {task_text}\n"
+        start_iter, end_iter = buffer.get_iter_at_mark(start), buffer.get_iter_at_mark(end)
+        with buffer.user_action:
+            buffer.delete(start_iter, end_iter)
+            buffer.insert_parsetree(buffer.get_iter_at_mark(start), Parser().parse(text))
+        buffer.delete_mark(start)
+        buffer.delete_mark(end)
+
+    @timed
     def fetch(self, force=False, all_history=False):
         """ Get the new tasks and insert them into page
         :type force: Cancels the action if False and cache file have been accessed recently.
@@ -756,10 +1652,13 @@ class GoogletasksController:
                  I have to admit that this task has been postponed few times.
                  But we cannot rely on fetching past-tasks only feature, its December date is seen nowhere.
 
+        :return: Number of the imported tasks, False if a task list could not be read.
+
         XX Add plugin option "import even completed tasks" ?
         """
         if all_history:
             force = True
+        self.flush_outbox()
 
         # Set the date since that we fetch the tasks
         cache_exists = self.cache.exists()
@@ -772,181 +1671,1278 @@ class GoogletasksController:
                 if now - last_time < max_hours * 3600 and \
                         datetime.datetime.now().day is datetime.datetime.fromtimestamp(last_time).day:
                     # if checked in last hours and there wasn't midnight (new tasks time) since then
-                    return
+                    return 0
             due_min = self.get_time(use_date=datetime.datetime.fromtimestamp(self.cache.last_time()),
                                     mode="midnight")
         else:  # load today's task (first run)
             due_min = self.get_time(mode="midnight")
 
         if all_history:  # all non-completed tasks
-            self.cache.items_ids.clear()  # re-import everything
             due_min = None
 
-        # Do internal fetching of new tasks text
+        # Do internal fetching of new tasks text, the task lists at once
+        targets = self.targets()
+        due_max = self.get_time(add_days=1, mode="midnight")
         try:
-            items = self._read_task_list(due_min)
-        except LookupError:
-            return
+            tasklists = {title: self.tasklist_id(title) for title in targets}  # may refresh lists in this thread only
+        except LookupError as e:
+            self.info(e)
+            return False
+        if all_history:
+            self.cache.forget(tasklists.values())  # re-import everything
+        futures = {title: self._executor.submit(Job.bind(self._fetch_list), title, tasklists[title], due_min, due_max)
+                   for title in targets}
+        items_by_page = defaultdict(list)
+        failed = False
+        for title, future in futures.items():
+            try:
+                items_by_page[targets[title]].extend(future.result())
+            except LookupError as e:
+                self.info(f"{title or 'Default list'}: {e}")
+                failed = True
+        if not any(items_by_page.values()):
+            self.info('No tasks found.')
+            return False if failed else 0
+
+        texts_by_page = {}
+        for page_name, items in items_by_page.items():
+            texts = texts_by_page[page_name] = []
+            for item in items:
+                if self.cache.is_imported(item):
+                    logger.debug('Text already imported {}.'.format(item['title']))
+                    continue
+                self.cache.mark_imported(item)
+                logger.info("Appending {}.".format(item["title"]))
+                logger.debug(item)
+                texts.append(self.get_task_text(item, self.preferences["include_start_date"]))
+        if not failed:
+            self.cache.legacy_etags.clear()  # every task list has been seen, the migrated etags are not needed
+        self.cache.evict()
+
+        # Refreshes pages from current configuration
+        for page_name, texts in texts_by_page.items():
+            page = self._update_page(ZimPath(page_name) if page_name else None,
+                                     lambda original, t=texts: self._insert_tasks(original, t) if t else None)
+            lists = ", ".join(title or "default" for title, target in targets.items() if target == page_name)
+            self.info(f"New tasks from list {lists}: {len(texts)}, page: {page.name}")
 
-        texts = []
-        items_ids = set()
-        for item in items:
-            if item["etag"] in self.cache.items_ids:
-                if self.get_time(from_string=item["due"], mode="object").date() \
-                        >= self.get_time(mode="object").date():
-                    items_ids.add(item["etag"])
-                logger.debug('Text already imported {}.'.format(item['title']))
-                continue
-            items_ids.add(item["etag"])
-            logger.info("Appending {}.".format(item["title"]))
-            logger.debug(item)
-            texts.append(self.get_task_text(item, self.preferences["include_start_date"]))
-        self.cache.items_ids = items_ids
-
-        # Refreshes page from current configuration
-        page = self._get_page()
-        s = " from list " + self.preferences['tasklist'] if self.preferences['tasklist'] else ""
-        self.info(f"New tasks{s}: {len(texts)}, page: {page.get_title()}")
-        if not texts:
-            if cache_exists:
-                self.cache.touch_save()
-            return
-        text = "\n".join(texts) + "\n"
+        # Save the list of successfully imported task
+        if any(texts_by_page.values()) or cache_exists:
+            self.cache.touch_save()
+        return False if failed else sum(len(texts) for texts in texts_by_page.values())
+
+    def _fetch_list(self, title, tasklist, due_min, due_max):
+        """ Refresh the task list in the store and return its tasks due in the range. Run in the `_executor`.
+        Every executor thread talks to the server through its own pooled service. """
+        with self.stats.span("fetch_list", tasklist=title or "@default"), \
+                profiled("fetch_list", self.preferences["profile"]):  # the thread is not seen by the caller profile
+            self.refresh_store(tasklist=tasklist)
+            return self.store.query(tasklist, due_min=due_min, due_max=due_max)
 
-        # Insert tasks string into page
+    @staticmethod
+    def _insert_tasks(original, texts):
+        """ Returns page lines with the task lines inserted after the first empty line (or at the end). """
+        text = "\n".join(texts) + "\n"
         appended = False
         contents = []
-        for line in page.dump("wiki"):
+        for line in original:
             contents.append(line)
             if line.strip() == "" and not appended:  # insert after first empty line
                 appended = True
                 contents.append(text)
         if not appended:  # or insert at the end of the page text
             contents.append(text)
+        return contents
+
+    @in_main_loop
+    def _read_page(self, path=None):
+        """ Returns the page (the task page by default) and its wiki lines. """
+        page = self.notebook.get_page(path) if path else self._get_page()
+        return page, page.dump("wiki")
+
+    @in_main_loop
+    def _update_page(self, path, transform):
+        """ Read the page (the task page by default), change its lines and store it in a single main loop call,
+        so that another job writing pages cannot change it in between.
+        :param transform: function(lines) → new lines, or None if the page stays as it is
+        :return: ZimPage
+        """
+        page, original = self._read_page(path)
+        contents = transform(original)
+        if contents is not None:
+            self._store_to_page(contents, page, original)
+        return page
 
-        self._store_to_page(contents, page)
+    @timed
+    @in_main_loop
+    def _store_to_page(self, contents, page, original=None):
+        """ Store the page, changing only the lines that differ from its current text.
 
-        # Save the list of successfully imported task
-        self.cache.touch_save()
-        # with open(CACHE_FILE, "wb") as f:
-        #     pickle.dump(self.item_ids, f)
-
-    def _store_to_page(self, contents, page):
-        """
+        If the page is shown, the changes are applied to the GTK buffer as a single undoable action.
+        Otherwise, the changed lines are patched directly in the source file.
+        If none of these is possible, the whole page text is parsed.
 
         :param contents: [] lines of the page
         :param page: ZimPage
+        :param original: [] lines of `page.dump("wiki")` if the caller already has them
         """
+        old = "".join(original or page.dump("wiki")).splitlines(keepends=True)
+        new = "".join(contents).splitlines(keepends=True)
+        opcodes = [op for op in SequenceMatcher(None, old, new, autojunk=False).get_opcodes() if op[0] != "equal"]
+        if not opcodes:
+            return
+
         bounds = buffer = None
-        if self.window and self.window.pageview.page.name is page.name:
+        if self.window and self.window.pageview.page and self.window.pageview.page.name == page.name:
             # HP is current page - we use GTK buffers, caret stays at position
             buffer = self.window.pageview.textview.get_buffer()
+            if buffer.get_line_count() in (len(old), len(old) + 1):  # buffer lines correspond to the wiki lines
+                with buffer.user_action:
+                    for _, i1, i2, j1, j2 in reversed(opcodes):
+                        if i2 > i1:
+                            end = buffer.get_iter_at_line(i2) if i2 < buffer.get_line_count() \
+                                else buffer.get_end_iter()
+                            buffer.delete(buffer.get_iter_at_line(i1), end)
+                        if j2 > j1:
+                            buffer.insert_parsetree(buffer.get_iter_at_line(i1), Parser().parse("".join(new[j1:j2])))
+                self.notebook.store_page(page)
+                return
             bounds = [x.get_offset() for x in buffer.get_selection_bounds()]
             if not bounds:
                 i = buffer.get_insert_iter()
                 bounds = [i.get_offset()] * 2
-        page.parse('wiki', "".join(contents))
+        elif self._patch_source(page, old, new, opcodes):
+            return
+
+        page.parse('wiki', "".join(new))
         self.notebook.store_page(page)
         if bounds:
             buffer.select_range(buffer.get_iter_at_offset(bounds[0]), buffer.get_iter_at_offset(bounds[1]))
 
+    def _patch_source(self, page, old, new, opcodes):
+        """ Rewrite the changed lines of the page source file without parsing the page.
+        Possible only if the file body is exactly what the wiki dumper produces.
+        :return: True if patched
+        """
+        file = page.source_file
+        if not file.exists():
+            return False
+        lines = file.readlines()
+        try:
+            header = lines.index("\n") + 1  # headers (Content-Type etc.) are followed by an empty line
+        except ValueError:
+            return False
+        if lines[header:] != old:
+            return False
+        for _, i1, i2, j1, j2 in reversed(opcodes):
+            lines[header + i1:header + i2] = new[j1:j2]
+        file.writelines(lines)
+        page.check_source_changed()  # forget the parsed tree, the page is reloaded from the file
+        self.notebook.index.update_file(file)
+        self._index_page(page)
+        return True
+
+    @in_main_loop
     def _get_page(self):
         return self.notebook.get_page(ZimPath(self.preferences["page"])) if self.preferences["page"] \
             else self.notebook.get_home_page()
 
+    @timed
     def sync_bullets_from_server(self):
-        """ Loops tasks found on the page and un/check them according to the Google server task status."""
+        """ Loops tasks found in the notebook and un/check them according to the Google server task status."""
 
+        self.flush_outbox()  # pending changes would be overwritten by the server status
         service = self.calendar_api.get_service(info="Syncing tasks status")
-
-        # build status cache from last 14 days so that we have to fetch one by one as little tasks as possible
-        # XX maybe we may check the number of tasks to be fetched one-by-one after that and if it is still big,
-        # perform more batch operation like this if there is a performance issue
-        try:
-            cache = {task["id"]: task["status"] == "completed" for task in
-                     self._read_task_list(self.get_time(add_days=-14, mode="midnight"),
-                                          show_completed=True,
-                                          service=service)}
-        except LookupError:
+        try:  # every imported list, the tasks found in the store are not looked up
+            futures = [self._executor.submit(Job.bind(self.refresh_store), tasklist=self.tasklist_id(title))
+                       for title in self.targets()]
+            for future in futures:
+                future.result()
+        except LookupError as e:
+            self.info(e)
             return False
 
-        allow_single_search = True
         unidentified_tasks = []
-        page = self._get_page()
-        contents = []
-        for line in page.dump("wiki"):
-            match = taskAnchorTreeRe.match(line)
-            if match:
-                task_id = match[2]
-                task_text = match[3]
-                completed = cache.get(task_id, None)
-
-                # perform single search if needed, this task was not fetched within the cache
-                if completed is None and allow_single_search:
-                    try:
-                        task = service.tasks().get(task=task_id, tasklist=self.tasklist).execute()
-                    except Error as e:
-                        self.info(e)
-                        unidentified_tasks.append(task_text)
-                    except (LookupError, httplib2.ServerNotFoundError) as e:
-                        self.info(e)
-                        allow_single_search = False
+        self.index_anchors()
+        anchors = self.store.anchors()
+        cache = self.store.statuses({anchor["task"] for anchor in anchors})
+        Stats.count("cache_hits", len(cache))
+
+        # resolve tasks that are not in the store (ex: from another task list) by batch requests
+        missing = {anchor["task"]: anchor["text"] for anchor in anchors if anchor["task"] not in cache}
+        if missing:
+            try:
+                tasklist = self.tasklist
+                requests = ((task_id, service.tasks().get(task=task_id, tasklist=tasklist)) for task_id in missing)
+                for task_id, task, exception in self._batch(service, requests):
+                    if exception:
+                        self.info(exception)
+                        unidentified_tasks.append(missing[task_id])
                     else:
-                        completed = task["status"] == "completed"
-
-                if completed is not None:  # we know the current status, replace the line
-                    # strip "[.] " (a dot may be "*", "x", " ") from the beginning
-                    task_s_without_bullet = match[0][(len(match[1]) if match[1] else 0):]
-                    # put "[*]" or "[ ]" to the beginning
-                    line = "[{0}] {1}".format(("*" if completed else " "), task_s_without_bullet) + "\n"
-
-            contents.append(line)
-        self._store_to_page(contents, page)
+                        cache[task_id] = task["status"] == "completed"
+                        self.store.put(tasklist, task)
+            except (LookupError, httplib2.HttpLib2Error, OSError, errors.Error) as e:
+                if not isinstance(e, (LookupError, errors.Error)):
+                    self.calendar_api.invalidate()
+                self.info(e)
+
+        # rewrite only the pages where a bullet differs from the server status
+        pages = {anchor["page"] for anchor in anchors
+                 if anchor["task"] in cache and anchor["bullet"] != ("*" if cache[anchor["task"]] else " ")}
+        pages.add(self._get_page().name)  # the task page is always refreshed from its current buffer
+
+        def with_statuses(original):
+            contents = []
+            for line in original:
+                match = taskAnchorTreeRe.match(line)
+                if match:
+                    completed = cache.get(match[2], None)
+                    if completed is not None:  # we know the current status, replace the line
+                        # strip "[.] " (a dot may be "*", "x", " ") from the beginning
+                        task_s_without_bullet = match[0][(len(match[1]) if match[1] else 0):]
+                        # put "[*]" or "[ ]" to the beginning
+                        line = "[{0}] {1}".format(("*" if completed else " "), task_s_without_bullet) + "\n"
+
+                contents.append(line)
+            return contents
+
+        for i, name in enumerate(sorted(pages)):
+            Job.progress(f"Updating page {name}", i / len(pages))
+            self._update_page(ZimPath(name), with_statuses)
         if unidentified_tasks:
             self.info(f"Cannot identify {len(unidentified_tasks)} tasks: " + ", ".join(unidentified_tasks))
 
+    @timed
+    def push_page_edits(self):
+        """ Send the edited titles, notes and start dates of the tasks on the shown page to the server.
+
+        Tasks are compared to their last known server version in the store, the changed ones are patched
+        by batch requests. Every patch requires the task etag is still the one imported onto the page
+        (the store one if the import ledger does not know the task); a task changed on the server meanwhile
+        is not overwritten but reported as a conflict.
+        Notes are compared only for the tasks having notes: the lines below the task line up to a blank
+        or a checkbox line. (Notes containing a blank line are not compared.)
+        :return: False if a task could not be sent
+        """
+        page, lines = self._read_page(self._shown_page())
+        changes = {}
+        "{task ID: (stored task, patch body)}"
+        conflicts = []
+        for i, line in enumerate(lines):
+            match = taskAnchorTreeRe.match(line.lstrip())
+            task = self.store.get(match[2]) if match else None
+            if not task:
+                continue
+            title, due = match[3].rstrip(), None
+            m = start_date_in_title.match(title)
+            if m:  # ex: 'test 13 _{//>2020-06-03//}'
+                title, due = (m[1] + m[4]).replace("_{////}", "").rstrip(), m[2]
+            body = {}
+            if title != (task["title"][4:] if task["title"].startswith("[ ] ") else task["title"]):
+                body["title"] = title
+            if due and due != (task["due"] or "")[:10]:
+                body["due"] = self.get_time(from_string=due, mode="morning")
+            if task["notes"] and "\n\n" not in task["notes"].strip("\n"):
+                notes = "".join(takewhile(lambda line_: line_.strip() and not checkboxRe.match(line_), lines[i + 1:]))
+                if notes.rstrip("\n") != task["notes"].rstrip("\n"):
+                    body["notes"] = notes.rstrip("\n")
+            if not body:
+                continue
+            imported = self.cache.imported.get(task["tasklist"], {}).get(match[2])
+            if imported and imported[0] != task["etag"]:  # the store has a newer server version than the page
+                conflicts.append(task["title"])
+            else:
+                changes[match[2]] = task, body
+        if not changes and not conflicts:
+            self.info(f"No edited task on page {page.name}")
+            return True
+
+        service = self.calendar_api.get_service(write_access=True, info=f"Sending edits of {len(changes)} tasks")
+
+        def requests():
+            for task_id, (task, body) in changes.items():
+                request = service.tasks().patch(tasklist=task["tasklist"], task=task_id, body=body)
+                request.headers["If-Match"] = task["etag"]  # 412 Precondition Failed if changed on the server
+                yield task_id, request
+
+        sent, refused = 0, 0
+        try:
+            for task_id, response, exception in self._batch(service, requests()):
+                task = changes[task_id][0]
+                if not exception:
+                    self._written(task["tasklist"], response, save=False)
+                    sent += 1
+                elif getattr(getattr(exception, "resp", None), "status", None) == 412:
+                    conflicts.append(task["title"])
+                else:
+                    self.info(f"Edit of the task '{task['title']}' refused: {exception}")
+                    refused += 1
+        except errors.Error as e:
+            self.info(f'Error in communication while sending the edits: {e}')
+            return False
+        except (httplib2.HttpLib2Error, OSError) as e:
+            self.calendar_api.invalidate()
+            self.info(f'Server not reachable, the edits were not sent: {e}')
+            return False
+        finally:
+            if sent:
+                self.cache.save()  # the edited tasks stay imported in their new version
+        self.info(f"Edits of {sent} tasks sent.")
+        if conflicts:
+            self.info(f"{len(conflicts)} tasks were changed on the server meanwhile, their edits were not sent"
+                      f" (import them again to see the server version): " + ", ".join(conflicts))
+        return not conflicts and not refused
+
+    @in_main_loop
+    def _shown_page(self):
+        """ The page shown in the window, the task page when run from the command line. """
+        return self.window.pageview.page if self.window else self._get_page()
+
+    @timed
+    def index_anchors(self):
+        """ Update the notebook-wide index of the task anchors for the pages changed since they were indexed.
+        The checkbox changes found are sent before returning, the caller may compare the bullets with the store then.
+        """
+        indexed = self.store.indexed_pages()
+        changed = {}
+        for page in self._pages_to_index(indexed):
+            Job.progress()
+            changed.update(self._index_page(page, send=False))
+        self.store.remove_pages(indexed)  # pages no more in the notebook
+        if changed:
+            self._send_statuses(changed)
+
+    @in_main_loop
+    def _pages_to_index(self, indexed):
+        """ Returns pages changed since indexed. Pops them from `indexed` so that only the pages to be removed stay.
+        :param indexed: {page name: mtime}
+        """
+        pages = []
+        for path in self.notebook.pages.walk():
+            mtime = indexed.pop(path.name, None)
+            page = self.notebook.get_page(path)
+            if page.source_file.exists() and page.source_file.mtime() != mtime:
+                pages.append(page)
+        return pages
+
+    def _index_page(self, page, send=True):
+        """ Index anchors of the page as stored in its source file.
+        The previous index is the snapshot of the checkboxes: the ones changed since then by any means
+        (undo, source editing, another program...) are sent to the server, see `_send_statuses`.
+        :param send: Send the changes in the background, else the caller sends them.
+        :return: {task ID: completed} of the changed checkboxes
+        """
+        anchors = []
+        changed = {}
+        if page.source_file.exists():
+            snapshot = {a["task"]: a["bullet"] == "*" for a in self.store.anchors(page=page.name) if a["bullet"]}
+            for i, line in enumerate(page.source_file.readlines()):
+                match = taskAnchorTreeRe.match(line)
+                if match:
+                    anchors.append((match[2], i, match[1][1] if match[1] else None, match[3].rstrip()))
+            self.store.set_anchors(page.name, page.source_file.mtime(), anchors)
+            changed = {task_id: bullet == "*" for task_id, _line, bullet, _text in anchors
+                       if bullet and task_id in snapshot and snapshot[task_id] != (bullet == "*")}
+            if changed and send:
+                self._executor.submit(self._send_statuses, changed)
+        else:
+            self.store.remove_pages([page.name])
+        return changed
+
+    @timed
+    def _send_statuses(self, changed):
+        """ Send the checkbox changes in a single batch request.
+        Changes the server already has (ex: sent when the checkbox was clicked, or synced from the server)
+        are skipped. When the server is not reachable, the changes are stored to the outbox.
+        :param changed: {task ID: completed}
+        """
+        pending = self.status_queue.pending()  # clicked, the queue sends them (or reverts the bullet)
+        changed = {task_id: completed for task_id, completed in changed.items() if task_id not in pending}
+        known = self.store.statuses(changed)
+        if len(known) < len(changed):  # ex: the store has not been filled for the task list yet
+            for title in self.targets():
+                with suppress(LookupError):
+                    self.refresh_store(tasklist=self.tasklist_id(title))
+            known = self.store.statuses(changed)
+        bodies, tasklists = {}, {}
+        for task_id, completed in changed.items():
+            if task_id not in known:  # not in the imported lists, sent to the main one as a click would be
+                try:
+                    tasklists[task_id] = self.tasklist
+                except LookupError as e:
+                    self.info(e)
+                    continue
+            elif known[task_id] != completed:
+                tasklists[task_id] = self.store.get(task_id)["tasklist"]
+            else:
+                continue
+            bodies[task_id] = self.status_body(completed)
+        if not bodies:
+            return
+        sent = set()
+        # noinspection PyBroadException
+        try:
+            service = self.calendar_api.get_service(write_access=True,
+                                                    info=f"Sending {len(bodies)} checkbox changes")
+            requests = ((task_id, service.tasks().patch(tasklist=tasklists[task_id], task=task_id, body=body))
+                        for task_id, body in bodies.items())
+            for task_id, response, exception in self._batch(service, requests):
+                sent.add(task_id)
+                if exception:
+                    self.info(f"Status of the task {task_id} refused: {exception}")
+                else:
+                    self._written(tasklists[task_id], response, save=False)
+            self.cache.save()
+            self.info(f"Status of {len(bodies)} tasks sent")
+        except (httplib2.HttpLib2Error, OSError) as e:
+            self.calendar_api.invalidate()
+            for task_id, body in bodies.items():
+                if task_id not in sent:
+                    self.outbox.add(tasklists[task_id], body, task_id, on_page=True)
+            self.info(f'Server not reachable ({e}), the changes will be sent later.')
+        except Exception as e:
+            self.info(f'Error in communication while sending checkbox changes: {e}')
+
+    @timed
     def refresh_task_lists(self):
         self.cache.load()
         service = self.calendar_api.get_service(info="Refreshing task lists")
         try:
-            results = service.tasklists().list().execute()
-        except httplib2.ServerNotFoundError:
+            items = list(self._paginate(service.tasklists().list))
+        except (httplib2.HttpLib2Error, OSError) as e:
+            self.calendar_api.invalidate()
+            self.info(e)
             return False
-        except Error as e:
+        except errors.Error as e:
             self.info(e)
             return False
-        items = results.get('items', [])
         if not items:
             self.info('No task lists found.')
             return
 
         self.cache.lists.clear()
+        self.cache.default_list = None  # identified again when needed, ex: the user has changed the account
         for tasklist in items:
             self.cache.lists[tasklist["title"]] = tasklist["id"]
         self.info(f'{len(items)} task lists discovered you can change to in the menu.')
         self.cache.save()
 
 
+class AnchorIndex:
+    """ Line number → task ID of the anchored lines of a TextBuffer, kept up to date from its signals.
+
+    The buffer is scanned once, then an insertion or a deletion only shifts the line numbers below it.
+    The lines touched by an edit that may change an anchor are re-read from the buffer when asked for.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._ids = {}
+        "{line: task ID}"
+        self._dirty = set()
+        "lines to be re-read"
+        start, end = buffer.get_bounds()
+        offset = 0
+        for line_i, line in enumerate(buffer.get_slice(start, end, include_hidden_chars=True).split("\n")):
+            pos = line.find(TASK_ANCHOR_SYMBOL)
+            if pos > -1:
+                task_id = self._link(offset + pos)
+                if task_id:
+                    self._ids[line_i] = task_id
+            offset += len(line) + 1
+        buffer.connect("insert-text", self._on_insert_text)
+        buffer.connect("delete-range", self._on_delete_range)
+
+    @classmethod
+    def of(cls, buffer):
+        """ The index of the buffer, created at the first use. """
+        index = getattr(buffer, "googletasks_anchors", None)
+        if not index:
+            index = buffer.googletasks_anchors = cls(buffer)
+        return index
+
+    def get(self, line_i):
+        if line_i in self._dirty:
+            self._dirty.discard(line_i)
+            task_id = GoogletasksController.read_task_id(line_i, self._buffer)
+            if task_id:
+                self._ids[line_i] = task_id
+            else:
+                self._ids.pop(line_i, None)
+        return self._ids.get(line_i)
+
+    def _link(self, offset):
+        # noinspection PyBroadException
+        try:
+            return self._buffer.get_link_data(self._buffer.get_iter_at_offset(offset))["href"].split("gtasks://")[1]
+        except Exception:
+            return None
+
+    def _shift(self, line_i, delta):
+        """ Move the lines below `line_i` by `delta`. """
+        self._ids = {(i + delta if i > line_i else i): task_id for i, task_id in self._ids.items()}
+        self._dirty = {(i + delta if i > line_i else i) for i in self._dirty}
+
+    def _on_insert_text(self, buffer, text_iter, text, length):
+        line_i = text_iter.get_line()
+        lines = text.count("\n")
+        if lines:
+            self._shift(line_i, lines)
+        if lines or TASK_ANCHOR_SYMBOL in text:
+            self._dirty.update(range(line_i, line_i + lines + 1))
+
+    def _on_delete_range(self, buffer, start, end):
+        first, last = start.get_line(), end.get_line()
+        if first != last:
+            for i in range(first + 1, last + 1):
+                self._ids.pop(i, None)
+                self._dirty.discard(i)
+            self._shift(last, first - last)
+            self._dirty.add(first)
+        elif TASK_ANCHOR_SYMBOL in buffer.get_slice(start, end, include_hidden_chars=True):
+            self._dirty.add(first)
+
+
+class StatusQueue:
+    """ Sends checkbox changes to the server from a background thread so that the GUI does not wait.
+
+    Repeated toggles of the same task are coalesced, only the last state is sent.
+    If sending fails, the bullet is reverted in the buffer.
+    """
+
+    def __init__(self, controller: GoogletasksController):
+        self.controller = controller
+        self._pending = {}
+        "{task_id: (bullet, buffer)} in the order of the first change"
+        self._sending = None
+        "task_id of the change being sent"
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def put(self, task_id, bullet, buffer=None):
+        with self._condition:
+            self._pending[task_id] = bullet, buffer
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name="googletasks-status", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def pending(self):
+        """ Returns the IDs of the tasks whose changes are waiting or being sent. """
+        with self._condition:
+            return set(self._pending) | ({self._sending} if self._sending else set())
+
+    def join(self):
+        """ Block till all the changes are sent. """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._thread)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._pending:
+                    self._thread = None
+                    self._condition.notify_all()
+                    return
+                task_id = next(iter(self._pending))
+                bullet, buffer = self._pending.pop(task_id)
+                self._sending = task_id
+            try:
+                sent = self.controller.task_checked(task_id, bullet)
+            except Exception:  # the thread must live on, the next changes would wait for it forever
+                logger.exception(f"[Googletasks] Status of the task {task_id} not sent")
+                sent = False
+            finally:
+                with self._condition:
+                    self._sending = None
+            if not sent and buffer:
+                GLib.idle_add(self._revert, task_id, bullet, buffer)
+
+    def _revert(self, task_id, bullet, buffer):
+        """ Restore the bullet of the task that could not be changed on the server. """
+        with self._condition:
+            if task_id in self._pending:  # user has toggled the task again meanwhile
+                return False
+        for line in range(buffer.get_line_count()):
+            if self.controller.get_task_id(line, buffer) == task_id:
+                buffer.set_bullet_original(line, UNCHECKED_BOX if bullet == CHECKED_BOX else CHECKED_BOX)
+        return False  # do not repeat the idle callback
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """ Runs an action in a background thread, showing its progress with a Cancel button if it takes long. """
+    _local = threading.local()
+    SHOW_AFTER = 500
+    "Milliseconds. Quick jobs do not flash a window."
+
+    def __init__(self, title, func, parent=None, quiet=False):
+        """ :param quiet: Never display the progress window by itself, ex: a background poll. """
+        self.title = title
+        self.running = True
+        self._func = func
+        self._cancelled = threading.Event()
+        self._text = title
+        self._fraction = None
+        self._window = self._label = self._bar = None
+        self._parent = parent
+        if not quiet:
+            GLib.timeout_add(self.SHOW_AFTER, self.show)
+        threading.Thread(target=self._run, name=f"googletasks-{title}", daemon=True).start()
+
+    @classmethod
+    def progress(cls, text=None, fraction=None):
+        """ Report the progress of the job running in the current thread.
+        Called at the points where the job may be interrupted, raises JobCancelled if the user cancelled it.
+        Does nothing if not called from a job.
+        """
+        job = getattr(cls._local, "job", None)
+        if not job:
+            return
+        if job._cancelled.is_set():
+            raise JobCancelled
+        if text:
+            job._text = text
+        job._fraction = fraction
+        GLib.idle_add(job._update)
+
+    @classmethod
+    def bind(cls, func):
+        """ Let `func`, run in another thread, report progress to the job of the current thread
+        (and be cancelled with it). """
+        job = getattr(cls._local, "job", None)
+
+        def run(*args, **kwargs):
+            cls._local.job = job
+            try:
+                return func(*args, **kwargs)
+            finally:
+                cls._local.job = None
+
+        return run
+
+    def cancel(self, *args):
+        self._cancelled.set()
+        if self._label:
+            self._label.set_text(_("Cancelling..."))
+
+    def _run(self):
+        self._local.job = self
+        try:
+            self._func()
+        except JobCancelled:
+            logger.info(f"[Googletasks] {self.title} cancelled")
+        except Exception:
+            logger.exception(f"[Googletasks] {self.title} failed")
+        finally:
+            self._local.job = None
+            GLib.idle_add(self._finish)
+
+    def show(self):
+        """ Display the progress window (if still running). """
+        if not self.running:
+            return False
+        if not self._window:
+            self._window = Gtk.Window(title=self.title, transient_for=self._parent)
+            self._window.set_default_size(300, -1)
+            box = Gtk.VBox(spacing=6)
+            box.set_border_width(10)
+            self._label = Gtk.Label(label=self._text)
+            self._bar = Gtk.ProgressBar()
+            button = Gtk.Button.new_with_mnemonic(_("_Cancel"))
+            button.connect("clicked", self.cancel)
+            self._window.connect("delete-event", lambda *_: self.cancel() or True)
+            for widget in (self._label, self._bar, button):
+                box.pack_start(widget, expand=False, fill=True, padding=0)
+            self._window.add(box)
+            self._window.show_all()
+        self._window.present()
+        return False  # do not repeat the timeout callback
+
+    def _update(self):
+        if self._window and not self._cancelled.is_set():
+            self._label.set_text(self._text)
+            if self._fraction is None:
+                self._bar.pulse()
+            else:
+                self._bar.set_fraction(self._fraction)
+        return False
+
+    def _finish(self):
+        self.running = False
+        if self._window:
+            self._window.destroy()
+        return False
+
+
+class SyncDaemon:
+    """ Keeps the notebooks in sync from a long-running process: zim --plugin googletasks --daemon [NOTEBOOK...]
+
+    The services stay warm between the polls. A notebook open in Zim is skipped: while the daemon runs, the Zim window
+    polls by itself and imports to its open pages (see `GoogletasksWindow._daemon_poll`). The daemon and Zim share
+    the notebook cache file, merged at save. The polling interval starts at POLL_MIN after a change and doubles
+    while nothing changes, up to POLL_MAX; a poll is always scheduled right after midnight when new tasks become due.
+    Running Zim instances talk to it over a Unix socket by JSON lines (see `daemon_request`):
+        {"cmd": "status"} -> {"ok": true, "notebooks": {name: last fetch result}, "interval": 60, ...}
+        {"cmd": "poke"} -> {"ok": true}  something was changed locally, poll soon
+        {"cmd": "refresh_store", "notebook": cache dir, "tasklist": ID} -> {"ok": true}  the notebook store is fresh
+    """
+
+    def __init__(self, controllers, path=DAEMON_SOCKET):
+        self.controllers = {str(c.notebook.cache_dir): c for c in controllers}
+        self.path = path
+        self.interval = POLL_MIN
+        self.last_poll = None
+        self.next_poll = time()
+        self.results = {}
+        "{notebook name: the last fetch result}"
+        self._refreshed = {}
+        "{(notebook cache dir, task list ID): time()} of the last store refresh"
+        self._wake = threading.Event()
+        self._lock = threading.RLock()
+
+    def run(self):
+        server = self._serve()
+        logger.info(f"[Googletasks] Daemon serving {len(self.controllers)} notebooks")
+        try:
+            while True:
+                timeout = self.next_poll - time()
+                if timeout > 0:
+                    self._wake.wait(timeout)
+                    self._wake.clear()
+                    continue
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+                Path(self.path).unlink(missing_ok=True)
+
+    def poll(self):
+        """ Import the new tasks to all the notebooks, a task list they share is downloaded once. """
+        new_tasks = 0
+        with self._lock:
+            controllers = []
+            for controller in self.controllers.values():
+                if controller.open_in_zim():  # Zim imports by itself, the pages are open in its buffers
+                    self.results[controller.notebook.name] = "open in Zim"
+                else:
+                    controllers.append(controller)
+                    controller.flush_outbox()
+            GoogletasksCommand._prefetch(controllers)
+            started = time()
+            try:
+                for controller in controllers:
+                    try:
+                        result = controller.fetch(True)
+                    except Exception:
+                        logger.exception(f"[Googletasks] {controller.notebook.name} failed")
+                        result = False
+                    self.results[controller.notebook.name] = result
+                    new_tasks += result or 0
+                    for title in controller.targets():
+                        with suppress(LookupError):
+                            self._refreshed[str(controller.notebook.cache_dir), controller.tasklist_id(title)] = started
+            finally:
+                for controller in controllers:
+                    controller.prefetched = {}
+        self.last_poll = started
+        self.interval = POLL_MIN if new_tasks else min(POLL_MAX, self.interval * 2)
+        self.next_poll = time() + poll_delay(self.interval)
+
+    def poke(self):
+        """ Poll soon and often again. """
+        self.interval = POLL_MIN
+        self.next_poll = min(self.next_poll, time() + POKE_DELAY)
+        self._wake.set()
+
+    def handle(self, request):
+        """ Answer a request of the socket. """
+        cmd = request.get("cmd")
+        if cmd == "status":
+            return {"ok": True, "notebooks": self.results, "interval": self.interval,
+                    "last_poll": self.last_poll, "next_poll": self.next_poll}
+        if cmd == "poke":
+            self.poke()
+            return {"ok": True}
+        if cmd == "refresh_store":
+            key = request.get("notebook"), request.get("tasklist")
+            controller = self.controllers.get(key[0])
+            if not controller or not key[1]:
+                return {"ok": False, "error": "Notebook not served"}
+            with self._lock:
+                if time() - self._refreshed.get(key, 0) > POLL_MIN:
+                    controller.refresh_store(tasklist=key[1])
+                    self._refreshed[key] = time()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown command {cmd}"}
+
+    def _serve(self):
+        """ Start serving the socket in a background thread. """
+        if not hasattr(socket, "AF_UNIX"):
+            logger.warning("[Googletasks] Unix sockets not available, Zim instances cannot talk to the daemon")
+            return None
+        Path(self.path).unlink(missing_ok=True)  # left by a daemon that did not stop cleanly
+        server = socketserver.ThreadingUnixStreamServer(self.path, _DaemonRequestHandler)
+        os.chmod(self.path, 0o600)
+        server.daemon_threads = True
+        server.sync_daemon = self
+        threading.Thread(target=server.serve_forever, name="googletasks-daemon", daemon=True).start()
+        return server
+
+
+class _DaemonRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.sync_daemon.handle(json.loads(line))
+            except Exception as e:
+                logger.exception("[Googletasks] Daemon request failed")
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+def poll_delay(interval):
+    """ Seconds until the next poll: the interval, or less so that the tasks of the new day are imported
+    right after midnight. """
+    tomorrow = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), datetime.time())
+    return min(interval, tomorrow.timestamp() + POKE_DELAY - time())
+
+
+def daemon_request(message, timeout=REQUEST_TIMEOUT, path=DAEMON_SOCKET):
+    """ Send the message to the running SyncDaemon. Returns its reply or None if no daemon is running. """
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        return json.loads(line) if line else None
+    except (OSError, ValueError) as e:
+        logger.debug(f"[Googletasks] Daemon not reachable: {e}")
+        return None
+
+
+class Outbox:
+    """ Journal of the requests that could not be sent because the server was not reachable.
+
+    Every entry is a JSON line: {"tasklist": ..., "task": task ID or None for an insert, "body": {...},
+                                 "on_page": the task stays on the page, see `GoogletasksController._written`}
+    """
+    _lock = threading.RLock()
+
+    def __init__(self, path: Path):
+        self._path = path
+
+    def add(self, tasklist, body, task_id=None, on_page=False):
+        with self._lock:
+            with open(self._path, "a") as f:
+                f.write(json.dumps({"tasklist": tasklist, "task": task_id, "body": body, "on_page": on_page}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read(self):
+        try:
+            return self._path.read_text().splitlines()
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _parse(line):
+        """ Returns the entry of the journal line or None if the line is broken. """
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if isinstance(entry, dict) and isinstance(entry.get("body"), dict) and {"tasklist", "task"} <= entry.keys():
+            return entry
+        return None
+
+    def entries(self):
+        """ Returns the entries with superseded ones collapsed (later patches of a task are merged into the first one).
+        Thanks to that, every task is mentioned once and the entries may be sent in any order (as batch does).
+        :return: (entries, number of journal lines read)
+        """
+        with self._lock:
+            lines = self._read()
+            entries = []
+            for line in lines:
+                entry = self._parse(line)
+                if entry:
+                    entries.append((line, entry))
+                else:
+                    logger.warning(f"[Googletasks] Skipping broken line of {self._path}: {line!r}")
+            if len(entries) < len(lines):  # ex: a crash while writing, the broken lines would stop the flushing
+                lines = [line for line, _ in entries]
+                self._write(lines)
+        collapsed = {}
+        for _, entry in entries:
+            key = (entry["tasklist"], entry["task"]) if entry["task"] else object()
+            if key in collapsed:
+                body = collapsed[key]["body"]
+                if "status" in entry["body"]:  # a later status replaces the former one with its completion time
+                    body.pop("completed", None)
+                body.update(entry["body"])
+                collapsed[key]["on_page"] = entry.get("on_page", False)
+            else:
+                collapsed[key] = entry
+        return list(collapsed.values()), len(lines)
+
+    def remove(self, count, keep=()):
+        """ Remove `count` first journal lines, put `keep` entries instead. """
+        with self._lock:
+            self._write([json.dumps(entry) for entry in keep] + self._read()[count:])
+
+    def _write(self, lines):
+        if not lines:
+            self._path.unlink(missing_ok=True)
+            return
+        write_atomic(self._path, "\n".join(lines) + "\n")
+
+
+class TaskStore:
+    """ Local SQLite mirror of the server task lists, refreshed incrementally by `GoogletasksController.refresh_store`.
+
+    Tasks are kept as dicts with the keys the API uses.
+    """
+    COLUMNS = ("id", "tasklist", "etag", "status", "due", "updated", "completed", "position", "title", "notes")
+
+    def __init__(self, path: Path):
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY, tasklist TEXT NOT NULL, etag TEXT, status TEXT, due TEXT, updated TEXT,
+                    completed TEXT, position TEXT, title TEXT, notes TEXT);
+                CREATE INDEX IF NOT EXISTS tasks_due ON tasks (tasklist, due);
+                CREATE INDEX IF NOT EXISTS tasks_status ON tasks (tasklist, status);
+                CREATE TABLE IF NOT EXISTS tasklists (id TEXT PRIMARY KEY, synced TEXT);
+                CREATE TABLE IF NOT EXISTS pages (name TEXT PRIMARY KEY, mtime REAL);
+                CREATE TABLE IF NOT EXISTS anchors (
+                    task TEXT NOT NULL, page TEXT NOT NULL, line INTEGER, bullet TEXT, text TEXT);
+                CREATE INDEX IF NOT EXISTS anchors_task ON anchors (task);
+                CREATE INDEX IF NOT EXISTS anchors_page ON anchors (page);
+            """)
+
+    def _put(self, tasklist, task):
+        if task.get("deleted"):
+            self._db.execute("DELETE FROM tasks WHERE id = ?", (task["id"],))
+        else:
+            self._db.execute(f"INSERT OR REPLACE INTO tasks VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                             [tasklist if c == "tasklist" else task.get(c) for c in self.COLUMNS])
+
+    def put(self, tasklist, task):
+        """ Store a task as returned by the server. """
+        with self._lock, self._db:
+            self._put(tasklist, task)
+
+    def update(self, tasklist, tasks, synced):
+        """ Store tasks in a single transaction.
+        :param tasks: An iterable, consumed before the store is locked so that a lazy download does not block it.
+        :param synced: Timestamp the next refresh should continue from.
+        """
+        tasks = list(tasks)
+        with self._lock, self._db:
+            for task in tasks:
+                self._put(tasklist, task)
+            self._db.execute("INSERT OR REPLACE INTO tasklists VALUES (?, ?)", (tasklist, synced))
+
+    def rename_tasklist(self, old, new):
+        """ Move the tasks stored under the `old` task list key to the `new` one. Both lists are downloaded
+        in full by the next refresh, their incremental refreshes continued from different times. """
+        with self._lock, self._db:
+            self._db.execute("UPDATE OR REPLACE tasks SET tasklist = ? WHERE tasklist = ?", (new, old))
+            self._db.execute("DELETE FROM tasklists WHERE id IN (?, ?)", (old, new))
+
+    def synced(self, tasklist):
+        """ Returns the timestamp of the last refresh or None. """
+        with self._lock:
+            row = self._db.execute("SELECT synced FROM tasklists WHERE id = ?", (tasklist,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, task_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+        return dict(row) if row else None
+
+    def query(self, tasklist, due_min=None, due_max=None, show_completed=False):
+        """ Returns tasks due within [due_min, due_max) ordered the way the server does. """
+        sql = "SELECT * FROM tasks WHERE tasklist = ?"
+        params = [tasklist]
+        if due_min:
+            sql += " AND due >= ?"
+            params.append(due_min)
+        if due_max:
+            sql += " AND due < ?"
+            params.append(due_max)
+        if not show_completed:
+            sql += " AND status = 'needsAction'"
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql + " ORDER BY due, position", params)]
+
+    def statuses(self, task_ids):
+        """ Returns {task_id: completed} of the given tasks found in the store. """
+        task_ids = list(task_ids)
+        result = {}
+        with self._lock:
+            for i in range(0, len(task_ids), 500):  # SQLite limits the number of variables
+                chunk = task_ids[i:i + 500]
+                result.update(self._db.execute(
+                    f"SELECT id, status = 'completed' FROM tasks WHERE id IN ({', '.join('?' * len(chunk))})",
+                    chunk).fetchall())
+        return {task_id: bool(completed) for task_id, completed in result.items()}
+
+    def indexed_pages(self):
+        """ Returns {page name: source file mtime} of the pages whose anchors are indexed. """
+        with self._lock:
+            return dict(self._db.execute("SELECT name, mtime FROM pages").fetchall())
+
+    def set_anchors(self, page, mtime, anchors):
+        """ Replace the page anchors.
+        :param anchors: [(task ID, line number in the source file, bullet character or None, task text)]
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM anchors WHERE page = ?", (page,))
+            self._db.executemany("INSERT INTO anchors VALUES (?, ?, ?, ?, ?)",
+                                 [(task_id, page, line, bullet, text) for task_id, line, bullet, text in anchors])
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (page, mtime))
+
+    def remove_pages(self, pages):
+        with self._lock, self._db:
+            for page in pages:
+                self._db.execute("DELETE FROM anchors WHERE page = ?", (page,))
+                self._db.execute("DELETE FROM pages WHERE name = ?", (page,))
+
+    def anchors(self, task_id=None, page=None):
+        """ Returns anchors of all the tasks in the notebook (or of the given task or page)
+        as dicts {task, page, line, bullet, text}. """
+        sql, params = "SELECT * FROM anchors", ()
+        if task_id:
+            sql, params = "SELECT * FROM anchors WHERE task = ?", (task_id,)
+        elif page:
+            sql, params = "SELECT * FROM anchors WHERE page = ?", (page,)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql + " ORDER BY page, line", params)]
+
+
+class Stats:
+    """ Timings of the operations and API calls, with counters of requests, retries, bytes and cache hits.
+
+    Every outermost span (a plugin operation) is appended as a line to a JSON lines file, inner spans (API calls,
+    page operations) are aggregated into it. The file is cut to the last STATS_KEEP records when it has twice as many.
+    """
+    COUNTERS = ("requests", "retries", "bytes", "cache_hits")
+    _local = threading.local()
+    "Spans open in the current thread (shared by all the instances so that InstrumentedHttp may count into them)."
+    _lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lines = None
+        "Number of the records in the file, counted at the first append."
+
+    @contextmanager
+    def span(self, name, **fields):
+        stack = self._local.__dict__.setdefault("stack", [])
+        record = {"operation": name, "started": time(), **fields, **{c: 0 for c in self.COUNTERS}}
+        stack.append(record)
+        start = perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(perf_counter() - start, 6)
+            stack.pop()
+            if stack:  # aggregate into the operation span
+                inner = stack[0].setdefault("spans", {}).setdefault(name, {"count": 0, "seconds": 0})
+                inner["count"] += 1
+                inner["seconds"] = round(inner["seconds"] + record["seconds"], 6)
+            else:
+                self._append(record)
+
+    @classmethod
+    def count(cls, counter, n=1):
+        """ Add to the counter of all the spans open in the current thread. """
+        for record in getattr(cls._local, "stack", ()):
+            record[counter] += n
+
+    def records(self):
+        try:
+            lines = self._path.read_text().splitlines()
+        except OSError:
+            return []
+        records = []
+        for line in lines[-STATS_KEEP:]:
+            with suppress(ValueError):  # a line cut by a crash
+                records.append(json.loads(line))
+        return records
+
+    def _append(self, record):
+        with self._lock:
+            try:
+                if self._lines is None:
+                    self._lines = len(self._path.read_text().splitlines()) if self._path.exists() else 0
+                with open(self._path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+                self._lines += 1
+                if self._lines >= 2 * STATS_KEEP:
+                    records = self.records()
+                    write_atomic(self._path, "".join(json.dumps(r) + "\n" for r in records))
+                    self._lines = len(records)
+            except OSError as e:
+                logger.warning(f"Cannot write stats: {e}")
+
+    def summary(self):
+        """ Returns a table of the recorded operations, the slowest first. """
+        groups = defaultdict(list)
+        for record in self.records():
+            groups[record["operation"], record.get("tasklist", "")].append(record)
+        if not groups:
+            return "No operations recorded yet."
+        rows = [f"{'operation':<26}{'task list':<20}{'count':>6}{'avg s':>9}{'max s':>9}"
+                f"{'requests':>9}{'retries':>8}{'kB':>9}{'cache hits':>11}"]
+        for (operation, tasklist), records in sorted(groups.items(),
+                                                     key=lambda g: -sum(r["seconds"] for r in g[1])):
+            seconds = [r["seconds"] for r in records]
+            rows.append(f"{operation:<26}{tasklist[:19]:<20}{len(records):>6}{sum(seconds) / len(seconds):>9.3f}"
+                        f"{max(seconds):>9.3f}{sum(r['requests'] for r in records):>9}"
+                        f"{sum(r['retries'] for r in records):>8}{sum(r['bytes'] for r in records) / 1024:>9.1f}"
+                        f"{sum(r['cache_hits'] for r in records):>11}")
+        return "\n".join(rows)
+
+
 class Cache:
+    VERSION = 3
+    "Version 1 was the jsonpickle format, version 2 had a flat set of the imported etags."
 
     def __init__(self, path: Path):
         self._path = path
-        self._loaded = False
-        self.items_ids = set()
-        "If user changes to another taks list, imports and changes back, items_ids are lost."
+        self._lock = threading.RLock()
+        "the ledger is updated by the threads that send the changes too"
+        self._mtime = None
+        "mtime of the file when it was last read or written, another process (the daemon or Zim) might change it"
+        self.imported = {}
+        "{task list ID: {task ID: [etag, import timestamp]}} ledger of the imported tasks, see `is_imported`"
+        self.legacy_etags = set()
+        "Imported etags migrated from version 2 (unknown task list and ID), dropped after the next import."
         self.lists = {}
         "{title: id}"
+        self.default_list = None
+        "ID of the default task list"
         self.last_fetched = 0
         "get initial datetime"
 
     def load(self):
-        if not self._loaded and self.exists():
-            self.__dict__.update(jsonpickle.decode(self._path.read_text()))
-            self._loaded = True
+        """ (Re)load the file if it has been changed since it was last read or written. """
+        with self._lock:
+            data = self._read_changed()
+            if data:
+                self.imported = data["imported"]
+                self.legacy_etags = set(data["legacy_etags"])
+                self.lists = data["lists"]
+                self.default_list = data.get("default_list")
+                self.last_fetched = data["last_fetched"]
         return self
 
+    def _read_changed(self):
+        """ Returns the file data if the file has been changed since it was last read or written, else None. """
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            return self._migrate(json.loads(self._path.read_text()))
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Cache file {self._path} is broken, ignoring: {e}")
+            return None
+
+    @staticmethod
+    def _migrate(data):
+        """ Converts data of an older version to the current one. """
+        if data.get("version", 1) == 1:  # jsonpickle encoded sets as {"py/set": [...]}
+            data = {k: v["py/set"] if isinstance(v, dict) and "py/set" in v else v for k, v in data.items()}
+            data["version"] = 2
+        if data["version"] == 2:
+            data["imported"], data["legacy_etags"] = {}, data.pop("items_ids")
+            data["version"] = 3
+        return data
+
     def save(self):
-        self._path.write_text(jsonpickle.encode({k: v for k, v in vars(self).items() if not k.startswith('_')}))
+        """ Write the file, merged with what another process has written to it meanwhile. """
+        with self._lock:
+            data = self._read_changed()
+            if data:
+                for tasklist, tasks in data["imported"].items():
+                    ours = self.imported.setdefault(tasklist, {})
+                    for task_id, entry in tasks.items():
+                        if task_id not in ours or ours[task_id][1] < entry[1]:
+                            ours[task_id] = entry
+                self.legacy_etags &= set(data["legacy_etags"])
+                self.default_list = self.default_list or data.get("default_list")
+                self.last_fetched = max(self.last_fetched, data["last_fetched"])
+            write_atomic(self._path, json.dumps({"version": self.VERSION,
+                                                 "imported": self.imported,
+                                                 "legacy_etags": list(self.legacy_etags),
+                                                 "lists": self.lists,
+                                                 "default_list": self.default_list,
+                                                 "last_fetched": self.last_fetched}))
+            self._mtime = os.stat(self._path).st_mtime_ns
+
+    def is_imported(self, task):
+        """ True if the task has been imported and not changed on the server since.
+        :param task: a task from the store (with its task list)
+        """
+        entry = self.imported.get(task["tasklist"], {}).get(task["id"])
+        if entry:
+            return entry[0] == task["etag"]
+        return task["etag"] in self.legacy_etags
+
+    def mark_imported(self, task):
+        """ Record the task as being on a page, in the version of its etag. """
+        with self._lock:
+            self.imported.setdefault(task["tasklist"], {})[task["id"]] = [task["etag"], time()]
+
+    def rename_tasklist(self, old, new):
+        """ Move the ledger of the `old` task list key to the `new` one. """
+        with self._lock:
+            ours = self.imported.setdefault(new, {})
+            for task_id, entry in self.imported.pop(old, {}).items():
+                if task_id not in ours or ours[task_id][1] < entry[1]:
+                    ours[task_id] = entry
+            if not ours:
+                del self.imported[new]
+
+    def forget(self, tasklists):
+        """ Forget the tasks imported from the task lists (IDs) so that they are imported again. """
+        with self._lock:
+            for tasklist in tasklists:
+                self.imported.pop(tasklist, None)
+            self.legacy_etags.clear()
+
+    def evict(self, ttl=LEDGER_TTL, size=LEDGER_SIZE):
+        """ Forget the tasks imported `ttl` seconds before the last fetch and the least recently imported above `size`.
+        They are past the time window of the next import anyway (it starts at the day of the last fetch). """
+        limit = self.last_fetched - ttl
+        with self._lock:
+            entries = sorted(((imported, tasklist, task_id)
+                              for tasklist, tasks in self.imported.items()
+                              for task_id, (etag, imported) in tasks.items()), reverse=True)
+            for imported, tasklist, task_id in entries[size:] + [e for e in entries[:size] if e[0] < limit]:
+                del self.imported[tasklist][task_id]
+            self.imported = {tasklist: tasks for tasklist, tasks in self.imported.items() if tasks}
 
     def exists(self):
         return os.path.isfile(self._path)
@@ -959,6 +2955,107 @@ class Cache:
         return self.last_fetched
 
 
+class HttpCache:
+    """ On-disk cache of HTTP responses for httplib2 (its `cache` interface: get, set, delete).
+
+    httplib2 revalidates the cached responses by If-None-Match with their ETag,
+    unchanged resources come back as 304 Not Modified with no body.
+    Only the resources requested again by the same URL are cached: the task lists and single tasks. The task list
+    contents are requested by a new `updatedMin` every time, caching them would just keep the tasks on the disk.
+    The least recently used responses are evicted when the cache exceeds `max_size` bytes.
+    """
+    CACHED = re.compile(r"/tasks/v1/(users/@me/lists|lists/[^/?]+/tasks/[^/?]+)(\?|$)")
+    "Keys (URLs) of the cached resources."
+
+    def __init__(self, path: Path, max_size=HTTP_CACHE_SIZE):
+        self._path = path
+        self._max_size = max_size
+        self._size = None
+        "Bytes, counted at the first write."
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return self._path / hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if not self.CACHED.search(key):
+            return None
+        file = self._file(key)
+        try:
+            content = file.read_bytes()
+            os.utime(file)  # mtime marks the last use
+        except OSError:
+            return None
+        return content
+
+    def set(self, key, value):
+        if not self.CACHED.search(key):
+            return
+        file = self._file(key)
+        with self._lock:
+            if self._size is None:
+                self._path.mkdir(parents=True, exist_ok=True)
+                os.chmod(self._path, 0o700)  # the responses contain private task titles and notes
+                self._size = sum(f.stat().st_size for f in self._path.iterdir())
+            try:
+                self._size -= file.stat().st_size
+            except OSError:
+                pass
+            try:
+                write_atomic(file, value)
+            except OSError as e:
+                logger.warning(f"Cannot write HTTP cache {file}: {e}")
+                return
+            self._size += len(value)
+            if self._size > self._max_size:
+                self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            try:
+                file = self._file(key)
+                size = file.stat().st_size
+                file.unlink()
+            except OSError:
+                return
+            if self._size is not None:
+                self._size -= size
+
+    def _evict(self):
+        """ Remove the least recently used files until the cache takes three quarters of the limit. """
+        files = []
+        for file in self._path.iterdir():
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, file))
+        files.sort()
+        self._size = sum(size for mtime, size, file in files)
+        for _, size, file in files:
+            if self._size <= self._max_size * 3 / 4:
+                break
+            try:
+                file.unlink()
+            except OSError:
+                continue
+            self._size -= size
+
+
+def write_atomic(path: Path, data):
+    """ Write the text or bytes via a temporary file so that a crash never leaves the file half written.
+    The temporary name is unique: Zim and the sync daemon may write the same file at once. """
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
 # initial check
 if not os.path.isfile(CLIENT_SECRET_FILE):
     quit(GoogletasksPlugin.plugin_info["name"] + "CLIENT_SECRET_FILE not found")